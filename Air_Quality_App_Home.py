@@ -1,8 +1,12 @@
 import streamlit as st
-from utils import load_raw_data, load_clean_data, show_df_info, perform_missing_value_analysis
+from dataset import is_partitioned
+from instrumentation import finish_rerun, stage, start_rerun
+from utils import DATA_FILE, OUTLIER_MODE, load_raw_data, get_clean_data, show_df_info, perform_missing_value_analysis, show_cleaning_steps, perform_outlier_analysis
+from warmup import wait_for_warmup
 
 
 st.set_page_config(page_title="Home", layout="wide")
+start_rerun("Home")
 
 st.title("Global Air Quality Dataset Explorer")
 
@@ -39,34 +43,43 @@ This app consists of the following pages:
 - Provides an overview of the app functionality.
 - Displays initial raw data and DataFrame info.
 - Shows missing values analysis.
-- Visualizes outliers with boxplots.
+- Shows the outlier bounds kept for each column, with optional boxplots of the data each bound was computed on.
 - Describes data cleaning.
 
 ### 2. Filtered Data Viewer (Explorer)
 - Allows the user to filter the cleaned dataset interactively.
 - Filters by City, Date Range, AQI, PM2.5, PM10, CO, NO2, SO2, O3.
-- Provides an option to export the filtered data to CSV.
+- Provides an option to export the filtered data to CSV, gzip-compressed CSV, or Parquet.
 
 ### 3. Data Visualization
 - Enables flexible visualization of key metrics.
-- Supports Line Chart, Bar Chart, Boxplot, Scatter Plot.
+- Supports Line Chart (raw or resampled hourly, daily, weekly, monthly), Bar Chart, Boxplot, Scatter Plot, and Correlation Matrix.
 - Allows filtering by City and Date Range.
-- Provides option to export chart data to CSV.
+- Provides option to export chart data to CSV, gzip-compressed CSV, or Parquet.
 
 ### 4. City Comparison Dashboard
 - Designed to compare air quality metrics across multiple cities.
-- Supports Bar Chart, Boxplot, and Summary Table views.
+- Supports Bar Chart, Boxplot, Trend Chart, Exceedance Analysis, and Summary Table views.
+- Exceedance Analysis counts the hours and episodes above a guideline limit and the hours per AQI category.
 - Allows filtering by Date Range.
-- Provides option to export comparison data to CSV.
+- Provides option to export comparison data to CSV, gzip-compressed CSV, or Parquet.
 
 ---
 
 Use the sidebar to navigate between pages and explore the dataset interactively.
 """)
 
+# Waiting for the background warm-up of the shared data (other sessions' work is never repeated)
+if not wait_for_warmup():
+    finish_rerun()
+    st.stop()
+
 # Loading raw data
-load_raw_data()
-df = st.session_state.df_raw
+df = load_raw_data()
+
+# A partitioned dataset is previewed from its first partition only
+if is_partitioned(DATA_FILE):
+    st.caption(f"Partitioned dataset `{DATA_FILE}`: the raw and cleaned data below are a sample from its first partition, the outlier bounds cover the whole dataset.")
 
 # Displaying raw data
 st.subheader("Raw Data (First 5 rows)")
@@ -79,12 +92,21 @@ show_df_info(df)
 # Missing value analysis
 perform_missing_value_analysis(df)
 
-# Loading clean data (also performs outlier analysis)
-load_clean_data()
-df_clean = st.session_state.df_clean
+# Loading clean data
+with stage("load_clean_data"):
+    df_clean, outlier_bounds = get_clean_data()
+
+# Describing data cleaning and outlier analysis
+show_cleaning_steps()
+if OUTLIER_MODE != "sequential":
+    st.caption(f"Outlier mode `{OUTLIER_MODE}` (set with AIR_QUALITY_OUTLIER_MODE).")
+show_boxplots = st.checkbox("Show outlier boxplots")
+perform_outlier_analysis(df, outlier_bounds, show_boxplots=show_boxplots)
 
 # Displaying cleaned data
 st.subheader("Cleaned Data (First 5 rows)")
 st.dataframe(df_clean.head())
 
 st.success(f"Final cleaned dataset shape: {df_clean.shape}")
+
+finish_rerun()
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+# European AQI bands: lower bound -> category
+AQI_CATEGORIES = {
+    0: "Good",
+    20: "Fair",
+    40: "Moderate",
+    60: "Poor",
+    80: "Very Poor",
+    100: "Extremely Poor",
+}
+
+# Exceedance limits (WHO 2021 guidelines, AQI from the Moderate band): metric -> (limit, averaging window in hours)
+EXCEEDANCE_LIMITS = {
+    'PM2.5': (15.0, 24),
+    'PM10': (45.0, 24),
+    'NO2': (25.0, 24),
+    'SO2': (40.0, 24),
+    'O3': (100.0, 8),
+    'CO': (4000.0, 24),
+    'AQI': (40.0, 1),
+}
+
+# Rolling averaging windows in hours
+ROLLING_WINDOWS = (1, 8, 24)
+
+ONE_HOUR_S = 3600
+
+
+def aqi_categories(values):
+    """Bucketing AQI values into the AQI_CATEGORIES bands (NaN stays missing)"""
+    values = np.asarray(values, dtype='float64')
+    codes = np.searchsorted(np.array(list(AQI_CATEGORIES), dtype='float64'), values, side='right') - 1
+    codes[np.isnan(values)] = -1
+    return pd.Categorical.from_codes(codes, categories=list(AQI_CATEGORIES.values()), ordered=True)
+
+
+def _series_blocks(df, by='City'):
+    """Numbering the contiguous series of df (one per value of by, in row order), returning the block of each row and the block starts"""
+    groups = df[by].to_numpy()
+    changes = np.concatenate([[True], groups[1:] != groups[:-1]]) if len(df) else np.array([], dtype=bool)
+    return np.cumsum(changes) - 1, np.flatnonzero(changes)
+
+
+def _block_seconds(df, blocks, gap):
+    """Turning Date into seconds offset per block (at least gap seconds apart), so one sorted key spans all series"""
+    seconds = df['Date'].to_numpy().astype('datetime64[s]').astype('int64')
+    if not len(seconds):
+        return seconds
+    seconds = seconds - seconds.min()
+    return blocks * (seconds.max() + gap + 1) + seconds
+
+
+def rolling_mean(df, metric, hours, by='City'):
+    """Averaging metric over the trailing window of hours (t - hours, t] of each row, per series
+
+    Like a time-based pandas rolling window, gaps in the readings shorten the window
+    instead of pulling in older rows; df must be sorted by Date within each series.
+    """
+    values = df[metric].to_numpy(dtype='float64')
+    if hours == 1 or not len(values):
+        return values
+
+    blocks, _ = _series_blocks(df, by)
+    keys = _block_seconds(df, blocks, hours * ONE_HOUR_S)
+    starts = np.searchsorted(keys, keys - hours * ONE_HOUR_S, side='right')
+
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    stops = np.arange(1, len(values) + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[stops] - sums[starts]) / (counts[stops] - counts[starts])
+
+
+def exceedance_runs(df, values, limit, by='City'):
+    """Finding the runs of consecutive hourly readings with values above limit, per series
+
+    Returns one row per run with its series (by), start Date and duration in hours.
+    """
+    blocks, _ = _series_blocks(df, by)
+    above = np.asarray(values) > limit
+
+    # A run continues from the previous reading of the same series one hour earlier
+    seconds = df['Date'].to_numpy().astype('datetime64[s]').astype('int64')
+    continues = np.zeros(len(above), dtype=bool)
+    continues[1:] = above[1:] & above[:-1] & (blocks[1:] == blocks[:-1]) & (np.diff(seconds) == ONE_HOUR_S)
+    run_starts = np.flatnonzero(above & ~continues)
+    durations = np.bincount(np.cumsum(above & ~continues)[above] - 1, minlength=len(run_starts))
+
+    return pd.DataFrame({
+        by: df[by].to_numpy()[run_starts],
+        'Date': df['Date'].to_numpy()[run_starts],
+        'hours': durations,
+    })
+
+
+def exceedance_summary(df, metric, limit, hours=1, by='City'):
+    """Summarizing the hours and episodes of the rolling mean of metric above limit, per series
+
+    Returns one row per series with the readings, hours above limit (and their share in %),
+    number of episodes (runs of consecutive hours) and the longest and mean episode in hours.
+    """
+    values = rolling_mean(df, metric, hours, by)
+    runs = exceedance_runs(df, values, limit, by)
+    blocks, starts = _series_blocks(df, by)
+    names = df[by].to_numpy()[starts]
+
+    summary = pd.DataFrame({
+        by: names,
+        'readings': np.bincount(blocks, minlength=len(starts)),
+        'hours_above': np.bincount(blocks, weights=values > limit, minlength=len(starts)).astype('int64'),
+    })
+    episodes = runs.groupby(by, observed=True, sort=False)['hours'].agg(['count', 'max', 'mean'])
+    episodes = episodes.reindex(names).fillna(0)
+    summary['share_above'] = 100 * summary['hours_above'] / summary['readings']
+    summary['episodes'] = episodes['count'].to_numpy().astype('int64')
+    summary['longest_hours'] = episodes['max'].to_numpy().astype('int64')
+    summary['mean_hours'] = episodes['mean'].to_numpy()
+    return summary
+
+
+def category_hours(df, by='City'):
+    """Counting the readings per series in each AQI category, one row per series and category"""
+    blocks, starts = _series_blocks(df, by)
+    codes = aqi_categories(df['AQI']).codes.astype('int64')
+    known = codes >= 0
+    counts = np.bincount(blocks[known] * len(AQI_CATEGORIES) + codes[known],
+                         minlength=len(starts) * len(AQI_CATEGORIES)).reshape(len(starts), len(AQI_CATEGORIES))
+
+    return pd.DataFrame({
+        by: np.repeat(df[by].to_numpy()[starts], len(AQI_CATEGORIES)),
+        'Category': pd.Categorical(np.tile(list(AQI_CATEGORIES.values()), len(starts)),
+                                   categories=list(AQI_CATEGORIES.values()), ordered=True),
+        'hours': counts.ravel(),
+    })
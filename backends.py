@@ -0,0 +1,542 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from analytics import category_hours, exceedance_summary
+from dataset import is_partitioned, read_bounds, read_dtypes, select_partitions, write_bounds
+from instrumentation import stage
+from query import count_rows, filter_data, normalize_query, page_rows, round_bound, sort_order
+from resample import DEFAULT_PERCENTILE, resample_series
+from rollups import METRICS, correlate_metrics, metric_pairs, pearson_matrix, summarize_metric
+from utils import (DATA_CACHE_DIR, DATA_FILE, DROP_COLUMNS, IQR_MULTIPLIER, OUTLIER_MODE, compact_dtypes,
+                   dataset_bounds_version, get_clean_data, get_data_options, get_derived, get_partitions, get_result, iqr_bounds,
+                   load_rollups, load_selection, measure_dtype)
+
+# Query backend used by the pages (e.g. AIR_QUALITY_BACKEND=duckdb), pandas by default
+BACKEND_ENV_VAR = "AIR_QUALITY_BACKEND"
+DEFAULT_BACKEND = "pandas"
+
+# Threads and memory used by DuckDB (None keeps its defaults: all cores, 80% of RAM)
+DUCKDB_THREADS = None
+DUCKDB_MEMORY_LIMIT = None
+
+# Process-wide DuckDB connection, each query running on its own cursor
+_duckdb = None
+_duckdb_lock = threading.Lock()
+
+
+def pandas_query(cities=None, date_range=None, ranges=None):
+    """Filtering the cleaned rows in memory via the City index"""
+    df_clean, city_index = load_selection(cities, date_range)
+    return filter_data(df_clean, cities, date_range, ranges, index=city_index)
+
+
+def pandas_count(cities=None, date_range=None, ranges=None):
+    """Counting the matching rows via the City index, without building them"""
+    df_clean, city_index = load_selection(cities, date_range)
+    return count_rows(df_clean, cities, date_range, ranges, index=city_index)
+
+
+def pandas_page(cities=None, date_range=None, ranges=None, sort_by=None, ascending=True, page=1, page_size=100):
+    """Slicing one page of the (cached) matching rows, in a sort order cached per query and sort key"""
+    filtered_df = query_data(cities, date_range, ranges, backend="pandas")
+    order = None
+    if sort_by is not None:
+        key = normalize_query(cities, date_range, ranges, backend="pandas", sort_by=sort_by, ascending=ascending)
+        order = get_result("sort_order", key, lambda: sort_order(filtered_df, sort_by, ascending))
+    return page_rows(filtered_df, page, page_size, order)
+
+
+def pandas_summarize(metric, cities=None, date_range=None):
+    """Summarizing a metric per City from the daily/monthly rollups"""
+    df_clean, city_index = load_selection(cities, date_range)
+    return summarize_metric(df_clean, city_index, load_rollups(cities, date_range), metric, cities, date_range)
+
+
+def pandas_correlate(cities=None, date_range=None):
+    """Correlating the metrics from the daily/monthly rollups"""
+    df_clean, city_index = load_selection(cities, date_range)
+    return correlate_metrics(df_clean, city_index, load_rollups(cities, date_range), cities, date_range)
+
+
+def pandas_resample(metric, cities=None, date_range=None, granularity='D', aggregator="Mean", percentile=DEFAULT_PERCENTILE):
+    """Resampling a metric per City from the (cached) matching rows"""
+    filtered_df = query_data(cities, date_range, backend="pandas")
+    return resample_series(filtered_df, metric, granularity, aggregator, percentile)
+
+
+def _duckdb_cursor():
+    """Returning a cursor on the shared DuckDB connection, spilling to the data cache directory when out of memory"""
+    global _duckdb
+    import duckdb
+
+    with _duckdb_lock:
+        if _duckdb is None:
+            source_dir = os.path.dirname(os.path.abspath(DATA_FILE))
+            config = {'temp_directory': os.path.join(source_dir, DATA_CACHE_DIR, "duckdb_tmp")}
+            if DUCKDB_THREADS:
+                config['threads'] = DUCKDB_THREADS
+            if DUCKDB_MEMORY_LIMIT:
+                config['memory_limit'] = DUCKDB_MEMORY_LIMIT
+            _duckdb = duckdb.connect(config=config)
+            # Dates are compared as UTC wall times, like the pandas cleaning
+            _duckdb.execute("SET TimeZone = 'UTC'")
+        return _duckdb.cursor()
+
+
+def _quote(name):
+    """Quoting a column name for SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value):
+    """Quoting a string for SQL"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _scan_sql(files):
+    """Building the SQL scan over CSV and Parquet files (Date read as text and parsed like the pandas cleaning)"""
+    scans = []
+    csv_files = [file for file in files if not file.endswith(".parquet")]
+    parquet_files = [file for file in files if file.endswith(".parquet")]
+    if csv_files:
+        scans.append(f"SELECT * FROM read_csv([{', '.join(map(_literal, csv_files))}], "
+                     f"header = true, union_by_name = true, types = {{'Date': 'VARCHAR'}})")
+    if parquet_files:
+        scans.append(f"SELECT * FROM read_parquet([{', '.join(map(_literal, parquet_files))}], union_by_name = true)")
+    return " UNION ALL BY NAME ".join(scans)
+
+
+def _source_files(path, cities=None, date_range=None):
+    """Listing the files to scan: the CSV itself, or the partitions overlapping the selection"""
+    if is_partitioned(path):
+        return list(select_partitions(get_partitions(path)[0], cities, date_range)['path'])
+    return [os.path.abspath(path)]
+
+
+def _measure_columns(cursor, scan, drop_columns):
+    """Listing the numeric measure columns of a scan, in file order"""
+    described = cursor.execute(f"DESCRIBE {scan}").fetchall()
+    numeric = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'FLOAT', 'DOUBLE', 'DECIMAL')
+    return [name for name, dtype, *_ in described
+            if name not in ('Date', 'City') and name not in drop_columns and dtype.startswith(numeric)]
+
+
+def _prepared_sql(scan, measures):
+    """Selecting Date (parsed, NULL if invalid), City and the measures of a scan"""
+    columns = ", ".join(f"CAST({_quote(col)} AS DOUBLE) AS {_quote(col)}" for col in measures)
+    return (f"SELECT TRY_CAST(TRY_CAST(Date AS TIMESTAMPTZ) AS TIMESTAMP) AS Date, City, {columns} "
+            f"FROM ({scan})")
+
+
+def _bounds_predicate(bounds):
+    """Building the SQL predicate keeping rows within the outlier bounds (per City for a per-city report)"""
+    if 'City' in bounds.columns:
+        cities = list(bounds['City'].unique())
+        clauses = [f"(City = {_literal(city)} AND {_bounds_predicate(city_bounds.drop(columns='City'))})"
+                   for city, city_bounds in bounds.groupby('City', sort=False)]
+        # Rows of cities the report does not cover are kept, as in apply_outlier_bounds
+        clauses.append(f"City NOT IN ({', '.join(map(_literal, cities)) or 'NULL'})")
+        return "(" + " OR ".join(clauses) + ")"
+
+    return " AND ".join(f"{_quote(col)} BETWEEN {float(lower)!r} AND {float(upper)!r}"
+                        for col, lower, upper in bounds[['Column', 'Lower Bound', 'Upper Bound']].itertuples(index=False, name=None)) or "TRUE"
+
+
+def duckdb_outlier_bounds(cursor, prepared, measures, iqr_multiplier=IQR_MULTIPLIER, sequential=True):
+    """Computing the outlier bounds report in SQL, column by column like filter_outliers
+
+    Sequentially each column's statistics are computed on the rows kept by the previous
+    columns; jointly all of them come from a single scan. The removed row counts of all
+    columns are then taken in one more scan.
+    """
+    def statistics(column):
+        return f"quantile_cont({column}, 0.25), quantile_cont({column}, 0.75), min({column}), max({column})"
+
+    if not sequential:
+        joint_statistics = cursor.execute(
+            f"SELECT {', '.join(statistics(_quote(col)) for col in measures)} FROM ({prepared})").fetchone()
+
+    report = []
+    removed_counts = []
+    keep = "TRUE"
+    for j, col in enumerate(measures):
+        column = _quote(col)
+        if sequential:
+            q1, q3, low, high = cursor.execute(f"SELECT {statistics(column)} FROM ({prepared}) WHERE {keep}").fetchone()
+        else:
+            q1, q3, low, high = joint_statistics[4 * j:4 * j + 4]
+        if q1 is None:
+            # No values left, so no rows are kept
+            break
+
+        lower_bound, upper_bound = iqr_bounds(q1, q3, iqr_multiplier)
+        in_bounds = f"{column} BETWEEN {float(lower_bound)!r} AND {float(upper_bound)!r}"
+        removed_counts.append(f"count(*) FILTER (WHERE {keep} AND NOT coalesce({in_bounds}, false))")
+        keep = f"{keep} AND {in_bounds}"
+
+        report.append((col, q1, q3, lower_bound, upper_bound, max(lower_bound, low), min(upper_bound, high)))
+
+    removed = cursor.execute(f"SELECT {', '.join(removed_counts)} FROM ({prepared})").fetchone() if report else ()
+    return pd.DataFrame([row + (count,) for row, count in zip(report, removed)],
+                        columns=['Column', 'Q1', 'Q3', 'Lower Bound', 'Upper Bound', 'Keep From', 'Keep To', 'Rows Removed'])
+
+
+def _duckdb_bounds(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the outlier bounds of the whole dataset, computed in SQL once per dataset version (in OUTLIER_MODE)
+
+    For a partitioned dataset the bounds stored next to the partitions are reused (and written if missing).
+    """
+    def build():
+        cursor = _duckdb_cursor()
+        if is_partitioned(path):
+            partitions = get_partitions(path)[0]
+            version = dataset_bounds_version(path, partitions, drop_columns, iqr_multiplier)
+            bounds = read_bounds(path, version)
+            if bounds is not None:
+                return bounds
+
+        scan = _scan_sql(_source_files(path))
+        measures = _measure_columns(cursor, scan, drop_columns)
+        prepared = _prepared_sql(scan, measures)
+        with stage("dataset_bounds"):
+            if OUTLIER_MODE == "per_city":
+                cities = [city for city, in cursor.execute(
+                    f"SELECT DISTINCT City FROM ({prepared}) WHERE City IS NOT NULL ORDER BY City").fetchall()]
+                bounds = pd.concat([
+                    duckdb_outlier_bounds(cursor, f"SELECT * FROM ({prepared}) WHERE City = {_literal(city)}",
+                                          measures, iqr_multiplier).assign(City=city)
+                    for city in cities
+                ], ignore_index=True)
+                bounds = bounds[['City'] + [col for col in bounds.columns if col != 'City']]
+            else:
+                bounds = duckdb_outlier_bounds(cursor, prepared, measures, iqr_multiplier,
+                                               sequential=(OUTLIER_MODE == "sequential"))
+
+        if is_partitioned(path):
+            try:
+                write_bounds(path, version, bounds)
+            except OSError:
+                # Read-only dataset directory, recomputing in the next process
+                pass
+        return bounds
+
+    return get_derived("duckdb_bounds", (tuple(drop_columns), iqr_multiplier, OUTLIER_MODE), build, path)
+
+
+def _duckdb_clean_sql(cursor, cities=None, date_range=None, path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER,
+                      cast=True):
+    """Building the SQL of the cleaned rows of a selection, or None if no files can hold any
+
+    Measures are cast to FLOAT after the outlier filtering (unless cast is False), mirroring
+    the float32 cleaned df.
+    """
+    files = _source_files(path, cities, date_range)
+    if not files:
+        return None
+
+    bounds = _duckdb_bounds(path, drop_columns, iqr_multiplier)
+    scan = _scan_sql(files)
+    measures = list(bounds['Column'].unique())
+    not_null = " AND ".join(f"{_quote(col)} IS NOT NULL" for col in ['Date', 'City'] + measures)
+    columns = ", ".join(f"CAST({_quote(col)} AS FLOAT) AS {_quote(col)}" if cast else _quote(col) for col in measures)
+    return (f"SELECT Date, City, {columns} FROM ({_prepared_sql(scan, measures)}) "
+            f"WHERE {_bounds_predicate(bounds)} AND {not_null}")
+
+
+def _duckdb_dtypes(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the column dtypes of the whole cleaned dataset, decided in SQL once per dataset version (like schema_dtypes)
+
+    Every query result is cast to them, so a subset never gets narrower dtypes than the
+    whole dataset. For a partitioned dataset they are stored next to the bounds.
+    """
+    def build():
+        bounds = _duckdb_bounds(path, drop_columns, iqr_multiplier)
+        if is_partitioned(path):
+            version = dataset_bounds_version(path, get_partitions(path)[0], drop_columns, iqr_multiplier)
+            dtypes = read_dtypes(path, version)
+            if dtypes is not None:
+                return dtypes
+
+        cursor = _duckdb_cursor()
+        clean = _duckdb_clean_sql(cursor, path=path, drop_columns=drop_columns, iqr_multiplier=iqr_multiplier, cast=False)
+        measures = list(bounds['Column'].unique())
+        if clean is None:
+            row, cities = (None,) * (3 * len(measures)), []
+        else:
+            # Whole values and their range are checked before the FLOAT cast, like on the float64 cleaned df
+            columns = ", ".join(f"bool_and({col} = round({col})), min({col}), max({col})" for col in map(_quote, measures))
+            row = cursor.execute(f"SELECT {columns} FROM ({clean})").fetchone()
+            cities = [city for city, in cursor.execute(f"SELECT DISTINCT City FROM ({clean})").fetchall()]
+
+        dtypes = {'Date': 'datetime64[ns]', 'City': pd.CategoricalDtype(sorted(cities))}
+        for i, col in enumerate(measures):
+            whole, low, high = row[3 * i:3 * i + 3]
+            dtypes[col] = measure_dtype(bool(whole), low, high)
+
+        if is_partitioned(path):
+            try:
+                write_bounds(path, version, bounds, dtypes)
+            except OSError:
+                # Read-only dataset directory, recomputing in the next process
+                pass
+        return dtypes
+
+    return get_derived("duckdb_dtypes", (tuple(drop_columns), iqr_multiplier, OUTLIER_MODE), build, path)
+
+
+def _selection_predicate(cities=None, date_range=None, ranges=None):
+    """Building the SQL predicate of the City, Date and metric range filters"""
+    parts = []
+    if cities is not None:
+        parts.append(f"City IN ({', '.join(map(_literal, cities)) or 'NULL'})")
+    if date_range is not None:
+        start_date = pd.to_datetime(date_range[0])
+        end_date = pd.to_datetime(date_range[1])
+        parts.append(f"Date BETWEEN TIMESTAMP {_literal(start_date)} AND TIMESTAMP {_literal(end_date)}")
+    for col, (low, high) in (ranges or {}).items():
+        parts.append(f"{_quote(col)} BETWEEN {float(low)!r} AND {float(high)!r}")
+    return " AND ".join(parts) or "TRUE"
+
+
+def duckdb_options():
+    """Computing the filter form options in DuckDB, once per dataset version"""
+    def build():
+        cursor = _duckdb_cursor()
+        clean = _duckdb_clean_sql(cursor)
+        measures = list(_duckdb_bounds()['Column'].unique())
+        columns = ", ".join(f"min({_quote(col)}), max({_quote(col)})" for col in measures)
+        row = cursor.execute(f"SELECT min(Date), max(Date), {columns} FROM ({clean})").fetchone()
+        cities = [city for city, in cursor.execute(f"SELECT DISTINCT City FROM ({clean}) ORDER BY City").fetchall()]
+        return {
+            'cities': cities,
+            'min_date': row[0].date(),
+            'max_date': row[1].date(),
+            'ranges': {col: (round_bound(row[2 + 2 * i]), round_bound(row[3 + 2 * i])) for i, col in enumerate(measures)},
+        }
+
+    return get_derived("duckdb_options", (), build)
+
+
+def duckdb_query(cities=None, date_range=None, ranges=None, path=DATA_FILE):
+    """Filtering the cleaned rows in DuckDB, scanning only the files that can hold the selection"""
+    cursor = _duckdb_cursor()
+    clean = _duckdb_clean_sql(cursor, cities, date_range, path)
+    if clean is None:
+        return get_clean_data(path)[0].iloc[0:0]
+
+    df = cursor.execute(f"SELECT * FROM ({clean}) WHERE {_selection_predicate(cities, date_range, ranges)} "
+                        f"ORDER BY City, Date").df()
+    return compact_dtypes(df, _duckdb_dtypes(path))
+
+
+def duckdb_count(cities=None, date_range=None, ranges=None, path=DATA_FILE):
+    """Counting the matching rows in DuckDB"""
+    cursor = _duckdb_cursor()
+    clean = _duckdb_clean_sql(cursor, cities, date_range, path)
+    if clean is None:
+        return 0
+    count, = cursor.execute(f"SELECT count(*) FROM ({clean}) WHERE {_selection_predicate(cities, date_range, ranges)}").fetchone()
+    return count
+
+
+def duckdb_page(cities=None, date_range=None, ranges=None, sort_by=None, ascending=True, page=1, page_size=100, path=DATA_FILE):
+    """Fetching one page of the matching rows from DuckDB, sorted with ties kept in City/Date order"""
+    cursor = _duckdb_cursor()
+    clean = _duckdb_clean_sql(cursor, cities, date_range, path)
+    if clean is None:
+        return get_clean_data(path)[0].iloc[0:0]
+
+    order_by = "City, Date"
+    if sort_by is not None:
+        order_by = f"{_quote(sort_by)} {'ASC' if ascending else 'DESC'}, {order_by}"
+    start = (page - 1) * page_size
+    df = cursor.execute(f"SELECT * FROM ({clean}) WHERE {_selection_predicate(cities, date_range, ranges)} "
+                        f"ORDER BY {order_by} LIMIT {int(page_size)} OFFSET {int(start)}").df()
+    df = compact_dtypes(df, _duckdb_dtypes(path))
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+
+def duckdb_summarize(metric, cities=None, date_range=None, path=DATA_FILE):
+    """Summarizing a metric per City in DuckDB (min and max as DOUBLE, like the rollups of the pandas backend)"""
+    cursor = _duckdb_cursor()
+    clean = _duckdb_clean_sql(cursor, cities, date_range, path)
+    if clean is None:
+        return pd.DataFrame(columns=['City', 'count', 'mean', 'std', 'min', 'max'])
+
+    column = _quote(metric)
+    return cursor.execute(
+        f"SELECT City, count(*) AS count, avg({column}) AS mean, stddev_samp({column}) AS std, "
+        f"min(CAST({column} AS DOUBLE)) AS min, max(CAST({column} AS DOUBLE)) AS max FROM ({clean}) "
+        f"WHERE {_selection_predicate(cities, date_range)} GROUP BY City ORDER BY City").df()
+
+
+def duckdb_correlate(cities=None, date_range=None, path=DATA_FILE):
+    """Correlating the metrics in DuckDB from the count, sums and sums of products of the selection"""
+    cursor = _duckdb_cursor()
+    clean = _duckdb_clean_sql(cursor, cities, date_range, path)
+    k = len(METRICS)
+    if clean is None:
+        return pearson_matrix(0, np.zeros(k), np.zeros((k, k))), 0
+
+    columns = {metric: f"CAST({_quote(metric)} AS DOUBLE)" for metric in METRICS}
+    pairs = [(a, a) for a in METRICS] + metric_pairs(METRICS)
+    row = cursor.execute(
+        f"SELECT count(*), {', '.join(f'sum({columns[metric]})' for metric in METRICS)}, "
+        f"{', '.join(f'sum({columns[a]} * {columns[b]})' for a, b in pairs)} "
+        f"FROM ({clean}) WHERE {_selection_predicate(cities, date_range)}").fetchone()
+
+    count = row[0]
+    sums = np.array(row[1:1 + k], dtype='float64')
+    products = np.zeros((k, k))
+    for (a, b), total in zip(pairs, row[1 + k:]):
+        products[METRICS.index(a), METRICS.index(b)] = products[METRICS.index(b), METRICS.index(a)] = total or 0.0
+    return pearson_matrix(count, np.nan_to_num(sums), products), count
+
+
+# DuckDB date_trunc parts of the resample granularities (weeks start on Monday)
+DUCKDB_DATE_PARTS = {'h': 'hour', 'D': 'day', 'W': 'week', 'M': 'month'}
+
+
+def duckdb_resample(metric, cities=None, date_range=None, granularity='D', aggregator="Mean", percentile=DEFAULT_PERCENTILE, path=DATA_FILE):
+    """Resampling a metric per City in DuckDB"""
+    cursor = _duckdb_cursor()
+    clean = _duckdb_clean_sql(cursor, cities, date_range, path)
+    if clean is None:
+        return pd.DataFrame(columns=['City', 'Date', metric, 'count'])
+
+    column = f"CAST({_quote(metric)} AS DOUBLE)"
+    aggregate = {
+        "Mean": f"avg({column})",
+        "Max": f"max({column})",
+        "Percentile": f"quantile_cont({column}, {percentile / 100!r})",
+    }[aggregator]
+    return cursor.execute(
+        f"SELECT City, date_trunc('{DUCKDB_DATE_PARTS[granularity]}', Date) AS Date, {aggregate} AS {_quote(metric)}, "
+        f"count(*) AS count FROM ({clean}) WHERE {_selection_predicate(cities, date_range)} "
+        f"GROUP BY ALL ORDER BY City, Date").df()
+
+
+# Query backends: name -> operation -> implementation
+QUERY_BACKENDS = {
+    "pandas": {
+        'options': get_data_options,
+        'query': pandas_query,
+        'count': pandas_count,
+        'page': pandas_page,
+        'summarize': pandas_summarize,
+        'resample': pandas_resample,
+        'correlate': pandas_correlate,
+    },
+    "duckdb": {
+        'options': duckdb_options,
+        'query': duckdb_query,
+        'count': duckdb_count,
+        'page': duckdb_page,
+        'summarize': duckdb_summarize,
+        'resample': duckdb_resample,
+        'correlate': duckdb_correlate,
+    },
+}
+
+
+def backend_name():
+    """Returning the configured query backend, falling back to pandas when DuckDB is not installed"""
+    name = os.environ.get(BACKEND_ENV_VAR, DEFAULT_BACKEND)
+    if name not in QUERY_BACKENDS:
+        raise ValueError(f"Unknown query backend {name!r}, expected one of {', '.join(QUERY_BACKENDS)}")
+    if name == "duckdb":
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            return DEFAULT_BACKEND
+    return name
+
+
+def load_data_options(backend=None):
+    """Loading the cities, date range and measure ranges for the filter forms"""
+    options = QUERY_BACKENDS[backend or backend_name()]['options']
+    with stage("load_data_options"):
+        return options()
+
+
+def query_data(cities=None, date_range=None, ranges=None, backend=None):
+    """Returning the cleaned rows matching the City, Date and metric range filters (shared, read-only)"""
+    backend = backend or backend_name()
+    query = QUERY_BACKENDS[backend]['query']
+    key = normalize_query(cities, date_range, ranges, backend=backend)
+    return get_result("query", key, lambda: query(cities, date_range, ranges))
+
+
+def count_data(cities=None, date_range=None, ranges=None, backend=None):
+    """Returning the number of cleaned rows matching the filters, without building them where the backend allows"""
+    backend = backend or backend_name()
+    count = QUERY_BACKENDS[backend]['count']
+    key = normalize_query(cities, date_range, ranges, backend=backend)
+    return get_result("count", key, lambda: count(cities, date_range, ranges))
+
+
+def page_data(cities=None, date_range=None, ranges=None, sort_by=None, ascending=True, page=1, page_size=100, backend=None):
+    """Returning one page (from 1) of the matching rows, sorted on the server by sort_by (filter order if None)"""
+    backend = backend or backend_name()
+    page_fn = QUERY_BACKENDS[backend]['page']
+    key = normalize_query(cities, date_range, ranges, backend=backend, sort_by=sort_by, ascending=ascending,
+                          page=page, page_size=page_size)
+    return get_result("page", key, lambda: page_fn(cities, date_range, ranges, sort_by, ascending, page, page_size))
+
+
+def summarize_data(metric, cities=None, date_range=None, backend=None):
+    """Returning the per-City count, mean, std, min and max of a metric (shared, read-only)"""
+    backend = backend or backend_name()
+    summarize = QUERY_BACKENDS[backend]['summarize']
+    key = normalize_query(cities, date_range, backend=backend, metric=metric)
+    return get_result("summary", key, lambda: summarize(metric, cities, date_range))
+
+
+def resample_data(metric, cities=None, date_range=None, granularity='D', aggregator="Mean", percentile=DEFAULT_PERCENTILE, backend=None):
+    """Returning a metric resampled per City and period, cached per dataset version (shared, read-only)"""
+    backend = backend or backend_name()
+    resample = QUERY_BACKENDS[backend]['resample']
+    key = normalize_query(cities, date_range, backend=backend, metric=metric, granularity=granularity,
+                          aggregator=aggregator, percentile=percentile)
+    return get_result("resample", key, lambda: resample(metric, cities, date_range, granularity, aggregator, percentile))
+
+
+def correlate_data(cities=None, date_range=None, backend=None):
+    """Returning the Pearson correlation matrix of the metrics and the number of readings (shared, read-only)"""
+    backend = backend or backend_name()
+    correlate = QUERY_BACKENDS[backend]['correlate']
+    key = normalize_query(cities, date_range, backend=backend)
+    return get_result("correlation", key, lambda: correlate(cities, date_range))
+
+
+def _city_subset(full, cities):
+    """Keeping the rows of a per-City result (sorted by City) for the given cities"""
+    return full[full['City'].isin(cities)].reset_index(drop=True)
+
+
+def exceedance_data(metric, limit, hours=1, cities=None, date_range=None, backend=None):
+    """Returning the per-City hours and episodes of the hours-long rolling mean of metric above limit (shared, read-only)
+
+    Series are independent per City, so without a date range (and for a single CSV) a
+    selection of cities is taken from the result over all cities, which the warm-up
+    precomputes for the guideline limits.
+    """
+    backend = backend or backend_name()
+    if cities is not None and date_range is None and not is_partitioned(DATA_FILE):
+        return _city_subset(exceedance_data(metric, limit, hours, backend=backend), cities)
+    key = normalize_query(cities, date_range, backend=backend, metric=metric, limit=float(limit), hours=hours)
+    return get_result("exceedance", key, lambda: exceedance_summary(query_data(cities, date_range, backend=backend),
+                                                                    metric, limit, hours))
+
+
+def category_data(cities=None, date_range=None, backend=None):
+    """Returning the per-City readings in each AQI category (shared, read-only; subsets of cities taken like exceedance_data)"""
+    backend = backend or backend_name()
+    if cities is not None and date_range is None and not is_partitioned(DATA_FILE):
+        return _city_subset(category_data(backend=backend), cities)
+    key = normalize_query(cities, date_range, backend=backend)
+    return get_result("aqi_categories", key, lambda: category_hours(query_data(cities, date_range, backend=backend)))
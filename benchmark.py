@@ -0,0 +1,267 @@
+"""Headless benchmarks of the load, clean, filter, aggregate and figure-build hot paths
+
+Usage: python benchmark.py [--scales 1 10 100] [--repeat 3] [--pages] [--imports]
+
+Each scale builds a synthetic copy of Air_Quality.csv with that many times the cities
+(and so rows), then reports the best wall time, peak traced memory and, for figures,
+the JSON size of every stage. --pages also times full runs of the page scripts with
+Streamlit's AppTest on the real dataset. --imports times the top-level imports of every
+page script in a fresh interpreter against IMPORT_BUDGET_SECONDS, listing any heavy module
+they load before it is needed.
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import analytics
+import backends
+import charts
+import query
+import rollups
+import resample
+import utils
+import warmup
+
+# Budget for the top-level imports of a page script in a fresh worker (Streamlit itself excluded)
+IMPORT_BUDGET_SECONDS = 0.5
+# Modules only the code paths that need them should import (a page importing one up front fails the check)
+HEAVY_MODULES = ("plotly.express", "duckdb", "pandasql", "sqlalchemy")
+
+# Run in a fresh interpreter: times the top-level imports of the script given as argument
+_IMPORT_PROBE = """
+import ast, json, sys, time
+import streamlit
+script = sys.argv[1]
+imports = [node for node in ast.parse(open(script).read()).body if isinstance(node, (ast.Import, ast.ImportFrom))]
+before = set(sys.modules)
+start = time.perf_counter()
+exec(compile(ast.Module(body=imports, type_ignores=[]), script, 'exec'), {})
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(set(sys.modules) - before)}))
+"""
+
+
+def make_synthetic_csv(scale, path, source=utils.DATA_FILE, seed=0):
+    """Writing scale jittered copies of source, growing both the cities and the rows per city
+
+    The copies go to about sqrt(scale) times the cities, each city's further copies shifted
+    after the source's time span, so every city covers about sqrt(scale) times as many hours.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(source)
+    numeric_columns = df.select_dtypes(include='number').columns
+    dates = pd.to_datetime(df['Date'], utc=True)
+    span = dates.max() - dates.min() + pd.Timedelta(hours=1)
+    city_copies = math.ceil(math.sqrt(scale))
+
+    copies = []
+    for i in range(scale):
+        copy = df.copy()
+        city_copy, period = i % city_copies, i // city_copies
+        if city_copy:
+            copy['City'] = copy['City'] + f" {city_copy}"
+        if period:
+            copy['Date'] = (dates + period * span).astype(str)
+        if i:
+            noise = rng.lognormal(0, 0.05, size=(len(copy), len(numeric_columns)))
+            copy[numeric_columns] = (copy[numeric_columns] * noise).round(1)
+        copies.append(copy)
+
+    pd.concat(copies).to_csv(path, index=False)
+    return path
+
+
+def measure(fn, repeat=3):
+    """Running fn repeat times, returning its result, the best wall time and the peak traced memory"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, best, peak
+
+
+def figure_size(fig):
+    """Returning the size in bytes of a figure's JSON"""
+    return len(fig.to_json())
+
+
+def bench_dataset(path, repeat=3):
+    """Benchmarking every stage on the dataset at path, returning one result row per stage"""
+    results = []
+
+    def run(stage, fn, figure=False):
+        result, seconds, peak = measure(fn, repeat)
+        results.append({
+            'stage': stage,
+            'seconds': seconds,
+            'peak_mb': peak / 2 ** 20,
+            'json_kb': figure_size(result) / 2 ** 10 if figure else np.nan,
+        })
+        return result
+
+    # Loading and cleaning
+    raw = run('read_csv', lambda: pd.read_csv(path))
+    df, _ = run('clean_data', lambda: utils.clean_data(raw))
+    prepared = utils.prepare_data(raw)
+    for mode in utils.OUTLIER_MODES:
+        run(f'filter_outliers_{mode}', lambda: utils.filter_outliers(prepared, mode=mode))
+
+    cache_dir = tempfile.mkdtemp()
+    cache_path = os.path.join(cache_dir, "clean.arrow")
+    run('write_clean_cache', lambda: utils._write_clean_cache(cache_path, df, pd.DataFrame()))
+    run('read_clean_cache', lambda: utils._read_clean_cache(cache_path))
+
+    # Filtering
+    index = run('build_city_index', lambda: query.build_city_index(df))
+    cities = list(index)[:2]
+    dates = (pd.Timestamp('2024-03-01'), pd.Timestamp('2024-09-30'))
+    ranges = {'AQI': (10.0, 40.0), 'PM2.5': (1.0, 20.0)}
+    run('filter_mask', lambda: query.filter_data(df, cities, dates, ranges))
+    run('filter_index', lambda: query.filter_data(df, cities, dates, ranges, index=index))
+
+    try:
+        import pandasql as ps
+    except ImportError:
+        pass
+    else:
+        frame = df.astype({'City': 'object'})
+        sql = (f"SELECT * FROM frame WHERE City IN ('{cities[0]}', '{cities[-1]}') "
+               f"AND Date >= '{dates[0]}' AND Date <= '{dates[1]}' "
+               "AND AQI >= 10.0 AND AQI <= 40.0 AND `PM2.5` >= 1.0 AND `PM2.5` <= 20.0")
+        run('filter_pandasql', lambda: ps.sqldf(sql, {'frame': frame}))
+
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        run('filter_duckdb', lambda: backends.duckdb_query(cities, dates, ranges, path=path))
+        run('summary_duckdb', lambda: backends.duckdb_summarize('AQI', path=path))
+        run('correlation_duckdb', lambda: backends.duckdb_correlate(cities, dates, path=path))
+        run('resample_duckdb', lambda: backends.duckdb_resample('AQI', granularity='D', path=path))
+
+    # Aggregating
+    store = run('build_rollups', lambda: rollups.build_rollups(df))
+    run('groupby_summary', lambda: df.groupby('City', observed=True)['AQI'].agg(['count', 'mean', 'std', 'min', 'max']))
+    summary = run('rollup_summary', lambda: rollups.summarize_metric(df, index, store, 'AQI'))
+    run('corr_pandas', lambda: df[rollups.METRICS].astype('float64').corr())
+    run('rollup_correlation', lambda: rollups.correlate_metrics(df, index, store, cities, dates))
+    for granularity in resample.GRANULARITIES.values():
+        run(f'resample_{granularity}', lambda: resample.resample_series(df, 'AQI', granularity))
+    for hours in analytics.ROLLING_WINDOWS:
+        run(f'exceedance_{hours}h', lambda: analytics.exceedance_summary(df, 'PM2.5', 15.0, hours))
+    run('aqi_categories', lambda: analytics.category_hours(df))
+
+    # Building figures
+    selection = query.filter_data(df, cities, index=index)
+    run('bar_figure', lambda: px.bar(summary, x='City', y='mean'), figure=True)
+    run('line_figure_all_points', lambda: px.line(selection, x='Date', y='AQI', color='City'), figure=True)
+    run('line_figure_downsampled', lambda: px.line(charts.downsample_series(selection, 'AQI'), x='Date', y='AQI', color='City'), figure=True)
+    run('box_figure_all_points', lambda: px.box(df, x='City', y='AQI', points="all"), figure=True)
+    run('box_figure_summarized', lambda: charts.box_figure(df, 'AQI', x='City'), figure=True)
+    run('scatter_figure_points', lambda: charts.scatter_figure(df, 'PM2.5', 'PM10', mode="Points")[0], figure=True)
+    run('scatter_figure_auto', lambda: charts.scatter_figure(df, 'PM2.5', 'PM10')[0], figure=True)
+
+    for row in results:
+        row['rows'] = len(df)
+    return results
+
+
+def page_scripts(here):
+    """Listing the app's page scripts, Home first"""
+    return ["Air_Quality_App_Home.py"] + sorted(
+        os.path.join("pages", name) for name in os.listdir(os.path.join(here, "pages")) if name.endswith(".py"))
+
+
+def bench_imports(repeat=3):
+    """Timing the top-level imports of every page script in fresh interpreters against the import budget"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get('PYTHONPATH')])))
+
+    results = []
+    for script in page_scripts(here):
+        runs = [json.loads(subprocess.run([sys.executable, "-c", _IMPORT_PROBE, script], cwd=here, env=env,
+                                          capture_output=True, text=True, check=True).stdout)
+                for _ in range(repeat)]
+        seconds = min(run['seconds'] for run in runs)
+        heavy = [module for module in HEAVY_MODULES if module in runs[0]['modules']]
+        results.append({
+            'page': script,
+            'import_seconds': seconds,
+            'budget_seconds': IMPORT_BUDGET_SECONDS,
+            'within_budget': seconds <= IMPORT_BUDGET_SECONDS,
+            'heavy_modules': ", ".join(heavy) or "-",
+        })
+    return results
+
+
+def bench_pages(repeat=3):
+    """Timing full headless runs of every page script on the real dataset"""
+    from streamlit.testing.v1 import AppTest
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    # Timing the pages themselves, not the placeholder shown while the background warm-up runs
+    os.environ[warmup.WARMUP_ENV_VAR] = "0"
+
+    results = []
+    for script in page_scripts(here):
+        def run_page():
+            return AppTest.from_file(os.path.join(here, script), default_timeout=300).run()
+        _, seconds, peak = measure(run_page, repeat)
+        results.append({'stage': f"page:{script}", 'seconds': seconds, 'peak_mb': peak / 2 ** 20, 'json_kb': np.nan})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], help="dataset scale factors")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage (best time is reported)")
+    parser.add_argument('--pages', action='store_true', help="also time page scripts with AppTest")
+    parser.add_argument('--imports', action='store_true', help="also check page import times against the budget")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            path = make_synthetic_csv(scale, os.path.join(tmp, f"air_quality_x{scale}.csv"))
+            for row in bench_dataset(path, args.repeat):
+                rows.append({'scale': scale, **row})
+
+    if args.pages:
+        for row in bench_pages(args.repeat):
+            rows.append({'scale': 1, 'rows': np.nan, **row})
+
+    report = pd.DataFrame(rows, columns=['scale', 'rows', 'stage', 'seconds', 'peak_mb', 'json_kb'])
+    report['rows'] = report['rows'].astype('Int64')
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.4f}'.format):
+        print(report.to_string(index=False))
+
+    if args.imports:
+        imports = pd.DataFrame(bench_imports(args.repeat))
+        with pd.option_context('display.width', 200, 'display.float_format', '{:.4f}'.format):
+            print()
+            print(imports.to_string(index=False))
+        # Failing when a page is over budget or imports a heavy module up front
+        if not imports['within_budget'].all() or (imports['heavy_modules'] != "-").any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
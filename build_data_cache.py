@@ -0,0 +1,29 @@
+"""Materializing the columnar cache of the cleaned dataset ahead of app start
+
+Usage: python build_data_cache.py [path/to/Air_Quality.csv] [--partition OUT_DIR]
+
+With --partition the CSV is split into a city=/month= partitioned dataset directory
+(usable as AIR_QUALITY_DATA) and the outlier bounds of the whole dataset are stored in it.
+"""
+import argparse
+
+import pandas as pd
+
+from dataset import is_partitioned, write_partitioned_dataset
+from utils import DATA_FILE, get_dataset_bounds, materialize_clean_data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=DATA_FILE, help="Source CSV (or partitioned dataset directory)")
+    parser.add_argument("--partition", metavar="OUT_DIR", help="Write the source CSV as a partitioned dataset directory")
+    args = parser.parse_args()
+
+    if args.partition:
+        get_dataset_bounds(write_partitioned_dataset(pd.read_csv(args.path), args.partition))
+        print(args.partition)
+    elif is_partitioned(args.path):
+        get_dataset_bounds(args.path)
+        print(args.path)
+    else:
+        print(materialize_clean_data(args.path))
@@ -0,0 +1,182 @@
+import numpy as np
+
+# Plotly is imported inside the figure builders, so importing this module stays cheap
+from utils import IQR_MULTIPLIER, get_result, iqr_bounds
+
+# Default number of points kept per city series in the Line Chart
+LINE_CHART_MAX_POINTS = 1000
+
+# Outlier points drawn per box in summarized box plots
+BOX_MAX_OUTLIERS = 200
+
+# Scatter Plot sizes switching to WebGL points and to a binned density view
+SCATTER_WEBGL_THRESHOLD = 1000
+SCATTER_DENSITY_THRESHOLD = 20000
+SCATTER_DENSITY_BINS = 100
+
+
+def minmax_positions(values, max_points):
+    """Returning sorted positions of values keeping the min and max of each bucket
+
+    values are split into max_points // 2 equal buckets of consecutive points; the first
+    and last points are always kept so the series spans the same range.
+    """
+    n = len(values)
+    if n <= max(max_points, 2):
+        return np.arange(n)
+
+    n_buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+
+    # Sorting by bucket then value: each bucket's min comes first and its max last
+    order = np.lexsort((values, bucket))
+    keep = np.concatenate([order[edges[:-1]], order[edges[1:] - 1], [0, n - 1]])
+    return np.unique(keep)
+
+
+def downsample_series(df, y, max_points=LINE_CHART_MAX_POINTS, by='City'):
+    """Downsampling each series of df (one per value of by, in row order) to about max_points rows, preserving peaks"""
+    values = df[y].to_numpy()
+    groups = df[by].to_numpy()
+
+    # Series are contiguous blocks of rows (df is sorted by City then Date)
+    starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]])) if len(df) else np.array([], dtype=int)
+    stops = np.append(starts[1:], len(df))
+
+    positions = [start + minmax_positions(values[start:stop], max_points) for start, stop in zip(starts, stops)]
+    if not positions:
+        return df
+    return df.iloc[np.concatenate(positions)]
+
+
+def box_stats(values, iqr_multiplier=IQR_MULTIPLIER, max_outliers=BOX_MAX_OUTLIERS):
+    """Computing the quartiles, Tukey whiskers and a capped sample of outliers of values
+
+    Whiskers end at the most extreme values within the IQR bounds; the outlier sample is
+    spread evenly over the sorted outliers so the most extreme ones are always kept.
+    """
+    values = np.asarray(values, dtype='float64')
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    lower_bound, upper_bound = iqr_bounds(q1, q3, iqr_multiplier)
+    in_bounds = (values >= lower_bound) & (values <= upper_bound)
+
+    outliers = np.sort(values[~in_bounds])
+    if len(outliers) > max_outliers:
+        outliers = outliers[np.linspace(0, len(outliers) - 1, max_outliers).round().astype(int)]
+
+    return {
+        'count': len(values),
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': values[in_bounds].min(),
+        'upperfence': values[in_bounds].max(),
+        'outliers': outliers,
+    }
+
+
+def box_figure(df, y, x=None, max_outliers=BOX_MAX_OUTLIERS):
+    """Building a box plot of y (per value of x) from server-side box statistics instead of raw points"""
+    if x is None:
+        groups = [(y, df[y].to_numpy())]
+    else:
+        groups = [(name, series.to_numpy()) for name, series in df.groupby(x, observed=True, sort=False)[y]]
+
+    names, stats = [], []
+    for name, values in groups:
+        group_stats = box_stats(values, max_outliers=max_outliers)
+        if group_stats is not None:
+            names.append(name)
+            stats.append(group_stats)
+
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    color = px.colors.qualitative.Plotly[0]
+    fig = go.Figure()
+    fig.add_trace(go.Box(
+        x=names,
+        q1=[s['q1'] for s in stats],
+        median=[s['median'] for s in stats],
+        q3=[s['q3'] for s in stats],
+        lowerfence=[s['lowerfence'] for s in stats],
+        upperfence=[s['upperfence'] for s in stats],
+        marker_color=color,
+        name=y,
+        showlegend=False,
+    ))
+
+    # Outliers as one extra marker trace
+    outlier_x = [name for name, s in zip(names, stats) for _ in s['outliers']]
+    if outlier_x:
+        fig.add_trace(go.Scatter(
+            x=outlier_x,
+            y=np.concatenate([s['outliers'] for s in stats]),
+            mode='markers',
+            marker_color=color,
+            name="Outliers",
+            showlegend=False,
+        ))
+
+    fig.update_layout(yaxis_title=y, xaxis_title=x)
+    return fig
+
+
+def density_figure(df, x, y, bins=SCATTER_DENSITY_BINS):
+    """Building a 2D histogram heatmap of x against y computed server-side"""
+    x_values = df[x].to_numpy(dtype='float64')
+    y_values = df[y].to_numpy(dtype='float64')
+    counts, x_edges, y_edges = np.histogram2d(x_values, y_values, bins=bins)
+
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=np.where(counts > 0, counts, np.nan).T,
+        colorscale='Viridis',
+        colorbar_title="Count",
+    ))
+    fig.update_layout(xaxis_title=x, yaxis_title=y)
+    return fig
+
+
+def scatter_figure(df, x, y, color=None, mode="Auto",
+                   webgl_threshold=SCATTER_WEBGL_THRESHOLD, density_threshold=SCATTER_DENSITY_THRESHOLD):
+    """Building a scatter plot of x against y, choosing SVG points, WebGL points or a density view
+
+    mode is "Auto" (by number of rows), "Points" or "Density"; returns the figure and the
+    render mode used.
+    """
+    if mode == "Auto":
+        mode = "Density" if len(df) > density_threshold else "Points"
+
+    if mode == "Density":
+        return density_figure(df, x, y), "Density"
+
+    import plotly.express as px
+
+    render_mode = 'webgl' if len(df) > webgl_threshold else 'svg'
+    fig = px.scatter(df, x=x, y=y, color=color, render_mode=render_mode)
+    return fig, "WebGL" if render_mode == 'webgl' else "SVG"
+
+
+def cached_figure(key, build):
+    """Returning the figure (and extra values) built by build() through the shared result cache
+
+    build returns (fig, *extra); the figure is cached as JSON under key (a normalized query)
+    so repeated and cross-user requests skip building it.
+    """
+    def build_json():
+        fig, *extra = build()
+        return fig.to_json(), tuple(extra)
+
+    import plotly.io as pio
+
+    fig_json, extra = get_result("figure", key, build_json)
+    return (pio.from_json(fig_json),) + extra
@@ -0,0 +1,114 @@
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# Partition files of a partitioned dataset directory, e.g. city=Cairo/month=2024-01/part-0.csv
+PARTITION_GLOB = os.path.join("city=*", "month=*", "*")
+PARTITION_EXTENSIONS = (".csv", ".parquet")
+
+# Sidecar file (in the dataset directory) with the outlier bounds of the whole dataset
+BOUNDS_FILE = "_bounds.json"
+
+
+def is_partitioned(path):
+    """Checking whether path is a partitioned dataset directory rather than a single CSV"""
+    return os.path.isdir(path)
+
+
+def list_partitions(path):
+    """Listing the partition files of a dataset directory with their City, Month and mtime"""
+    rows = []
+    for file in glob.glob(os.path.join(path, PARTITION_GLOB)):
+        if not file.endswith(PARTITION_EXTENSIONS):
+            continue
+        month_dir = os.path.dirname(file)
+        city = os.path.basename(os.path.dirname(month_dir)).split("=", 1)[1]
+        month = os.path.basename(month_dir).split("=", 1)[1]
+        rows.append((city, pd.Timestamp(month), file, os.stat(file).st_mtime_ns))
+
+    partitions = pd.DataFrame(rows, columns=['City', 'Month', 'path', 'mtime_ns'])
+    return partitions.sort_values(['City', 'Month', 'path'], kind='stable').reset_index(drop=True)
+
+
+def partitions_version(path, partitions):
+    """Identifying a version of a partitioned dataset from its files and their mtimes"""
+    digest = hashlib.sha256()
+    for file, mtime_ns in zip(partitions['path'], partitions['mtime_ns']):
+        digest.update(f"{os.path.relpath(file, path)}:{mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()[:20]
+
+
+def select_partitions(partitions, cities=None, date_range=None):
+    """Selecting the partitions that can hold rows for the given cities and inclusive date range"""
+    keep = pd.Series(True, index=partitions.index)
+
+    if cities is not None:
+        keep &= partitions['City'].isin(cities)
+
+    if date_range is not None:
+        start_date = pd.to_datetime(date_range[0])
+        end_date = pd.to_datetime(date_range[1])
+        month_end = partitions['Month'] + pd.offsets.MonthBegin(1)
+        keep &= (month_end > start_date) & (partitions['Month'] <= end_date)
+
+    return partitions[keep]
+
+
+def read_partition(file, city=None):
+    """Reading the raw rows of one partition file, filling City from the partition if missing"""
+    df = pd.read_parquet(file) if file.endswith(".parquet") else pd.read_csv(file)
+    if 'City' not in df.columns and city is not None:
+        df.insert(1, 'City', city)
+    return df
+
+
+def _read_stored(path, version):
+    """Reading the bounds file of a dataset directory, or None if missing or outdated"""
+    bounds_path = os.path.join(path, BOUNDS_FILE)
+    if not os.path.exists(bounds_path):
+        return None
+
+    with open(bounds_path) as f:
+        stored = json.load(f)
+    if stored.get('version') != version:
+        return None
+    return stored
+
+
+def read_bounds(path, version):
+    """Reading the stored outlier bounds of a dataset directory, or None if missing or outdated"""
+    stored = _read_stored(path, version)
+    return pd.DataFrame(**stored['bounds']) if stored is not None else None
+
+
+def read_dtypes(path, version):
+    """Reading the stored column dtypes of the cleaned dataset, or None if missing or outdated"""
+    stored = _read_stored(path, version)
+    if stored is None or 'dtypes' not in stored:
+        return None
+    return {col: pd.CategoricalDtype(dtype) if isinstance(dtype, list) else dtype for col, dtype in stored['dtypes'].items()}
+
+
+def write_bounds(path, version, bounds, dtypes=None):
+    """Storing the outlier bounds (and the column dtypes of the cleaned dataset, if known) of a dataset directory next to its partitions"""
+    # Python's json writes floats at full precision (to_json rounds them)
+    stored = {'version': version, 'bounds': bounds.to_dict(orient='split', index=False)}
+    if dtypes is not None:
+        # Categorical dtypes are stored as their list of categories
+        stored['dtypes'] = {col: list(dtype.categories) if isinstance(dtype, pd.CategoricalDtype) else str(dtype)
+                            for col, dtype in dtypes.items()}
+    with open(os.path.join(path, BOUNDS_FILE), "w") as f:
+        json.dump(stored, f)
+
+
+def write_partitioned_dataset(df_raw, out_dir):
+    """Splitting a raw dataset into a city=/month= partitioned directory of CSV files"""
+    months = pd.to_datetime(df_raw['Date'], errors='coerce', utc=True).dt.strftime('%Y-%m')
+    for (city, month), part in df_raw.groupby([df_raw['City'], months], sort=True):
+        part_dir = os.path.join(out_dir, f"city={city}", f"month={month}")
+        os.makedirs(part_dir, exist_ok=True)
+        part.to_csv(os.path.join(part_dir, "part-0.csv"), index=False)
+    return out_dir
@@ -0,0 +1,67 @@
+import gzip
+import io
+
+import streamlit as st
+
+from instrumentation import stage
+from utils import get_export
+
+# Export formats: file extension and MIME type
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+# Rows encoded per CSV chunk
+EXPORT_CHUNK_ROWS = 10000
+
+
+def iter_csv_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Encoding df as CSV in chunks of rows, yielding UTF-8 bytes (header with the first chunk)"""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(index=False, header=(start == 0)).encode('utf-8')
+
+
+def export_bytes(df, export_format="CSV"):
+    """Encoding df in the given export format, returning the whole file as bytes
+
+    st.download_button serves a complete payload, so the file is not streamed to the
+    browser; encoding CSV in chunks only avoids holding the full CSV text next to it.
+    """
+    buffer = io.BytesIO()
+
+    with stage("export_encode", rows=len(df)):
+        if export_format == "Parquet":
+            df.to_parquet(buffer, index=False)
+        elif export_format == "CSV (gzip)":
+            with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+                for chunk in iter_csv_chunks(df):
+                    f.write(chunk)
+        else:
+            for chunk in iter_csv_chunks(df):
+                buffer.write(chunk)
+
+    # Without an exported view, getvalue() hands over the buffer's bytes instead of copying them
+    return buffer.getvalue()
+
+
+def export_button(label, df, file_name, query_key, export_format="CSV"):
+    """Displaying a download button that encodes df (or the df returned by a function) only when clicked
+
+    The encoded file is kept in the shared result cache under query_key (a normalized query
+    of the dataset), so repeated downloads of the same selection are not re-encoded.
+    """
+    extension, mime = EXPORT_FORMATS[export_format]
+
+    def build():
+        return get_export((query_key, export_format), lambda: export_bytes(df() if callable(df) else df, export_format))
+
+    st.download_button(
+        label=label,
+        data=build,
+        file_name=file_name + extension,
+        mime=mime,
+        on_click="ignore"
+    )
@@ -0,0 +1,79 @@
+import io
+import os
+
+import pandas as pd
+
+from query import build_city_index
+from utils import apply_outlier_bounds, compact_dtypes, fits_dtypes, prepare_data
+
+# Bytes before the last ingested offset compared to detect rewritten (not appended) files
+TAIL_FINGERPRINT_BYTES = 1024
+
+
+def read_header(path):
+    """Reading the CSV header line of path"""
+    with open(path, 'rb') as f:
+        return f.readline()
+
+
+def tail_fingerprint(path, offset):
+    """Reading the bytes just before offset, used to check that path was only appended to since"""
+    with open(path, 'rb') as f:
+        f.seek(max(offset - TAIL_FINGERPRINT_BYTES, 0))
+        return f.read(min(offset, TAIL_FINGERPRINT_BYTES))
+
+
+def read_appended_rows(path, offset, header, fingerprint):
+    """Parsing the complete rows appended to path after offset
+
+    Returns the raw rows and the offset after the last complete line, or None if the file
+    shrank or its content before offset changed (a full reload is needed then).
+    """
+    if os.stat(path).st_size < offset or tail_fingerprint(path, offset) != fingerprint:
+        return None
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        tail = f.read()
+
+    # Leaving a partially written last line for the next ingest
+    tail = tail[:tail.rfind(b'\n') + 1]
+    raw_new = pd.read_csv(io.BytesIO(header + tail))
+    return raw_new, offset + len(tail)
+
+
+def clean_appended_rows(raw_new, bounds, drop_columns):
+    """Cleaning appended raw rows with the stored outlier bounds instead of recomputing them"""
+    return apply_outlier_bounds(prepare_data(raw_new, drop_columns), bounds).dropna()
+
+
+def append_rows(df, index, new_rows):
+    """Merging new cleaned rows into df, keeping it sorted by City then Date
+
+    Each city's new rows are placed after its existing block and cast to the dtypes of df.
+    Returns None when a new row is not later than the existing rows of its city, or does
+    not fit those dtypes (a full rebuild is needed then, deciding the dtypes anew).
+    """
+    # Keeping the dtypes of df, with the City categories extended by new cities
+    dtypes = df.dtypes.to_dict()
+    dtypes['City'] = pd.CategoricalDtype(sorted(set(dtypes['City'].categories) | set(new_rows['City'].astype(str))))
+    if not fits_dtypes(new_rows, dtypes):
+        return None
+
+    new_rows = new_rows.sort_values(['City', 'Date'], kind='stable').reset_index(drop=True)
+    new_index = build_city_index(new_rows)
+
+    dates = df['Date'].to_numpy()
+    new_dates = new_rows['Date'].to_numpy()
+    for city, (start, stop) in new_index.items():
+        if city in index and new_dates[start] <= dates[index[city][1] - 1]:
+            return None
+
+    parts = []
+    for city in sorted(set(index) | set(new_index)):
+        if city in index:
+            parts.append(df.iloc[index[city][0]:index[city][1]])
+        if city in new_index:
+            parts.append(new_rows.iloc[new_index[city][0]:new_index[city][1]])
+
+    return compact_dtypes(pd.concat(parts, ignore_index=True), dtypes)
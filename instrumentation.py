@@ -0,0 +1,166 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import pandas as pd
+import streamlit as st
+
+logger = logging.getLogger("air_quality.timings")
+
+# Setting this environment variable (or ?debug=1 in the URL) shows the timings panel
+DEBUG_ENV_VAR = "AIR_QUALITY_DEBUG"
+# Setting this environment variable logs the timings of every page run to stderr (one JSON line each)
+TIMINGS_LOG_ENV_VAR = "AIR_QUALITY_TIMINGS_LOG"
+# File rewritten with the process-wide totals (Prometheus text format) after every page run, e.g. for a textfile collector
+METRICS_FILE_ENV_VAR = "AIR_QUALITY_METRICS_FILE"
+
+# Stage timings of the rerun running on the current thread
+_rerun = threading.local()
+
+# Process-wide totals: (page, stage) -> [calls, seconds, rows]
+_totals = defaultdict(lambda: [0, 0.0, 0])
+_totals_lock = threading.Lock()
+
+# Process-wide cache lookups: kind -> [hits, misses]
+_cache_lookups = defaultdict(lambda: [0, 0])
+
+
+def _configure_logger():
+    """Attaching a stderr handler to the timings logger when requested, unless logging already has one"""
+    if os.environ.get(TIMINGS_LOG_ENV_VAR) and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+_configure_logger()
+
+
+def start_rerun(page):
+    """Starting the stage timings of a page script rerun"""
+    _rerun.page = page
+    _rerun.records = []
+    _rerun.started = time.perf_counter()
+
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """Timing a stage of the current rerun; the yielded record's 'rows' can be set inside the block"""
+    record = {'stage': name, 'rows': rows, 'seconds': 0.0}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        page = getattr(_rerun, 'page', None) or "-"
+
+        records = getattr(_rerun, 'records', None)
+        if records is not None:
+            records.append(record)
+
+        with _totals_lock:
+            totals = _totals[(page, name)]
+            totals[0] += 1
+            totals[1] += record['seconds']
+            totals[2] += record['rows'] or 0
+
+
+def record_cache(kind, hit):
+    """Counting a shared cache lookup of the given kind as a hit or a miss"""
+    with _totals_lock:
+        _cache_lookups[kind][0 if hit else 1] += 1
+
+
+def cache_stats():
+    """Returning the hits, misses and hit rate of the shared cache lookups per kind"""
+    with _totals_lock:
+        rows = [(kind, hits, misses) for kind, (hits, misses) in sorted(_cache_lookups.items())]
+    stats = pd.DataFrame(rows, columns=['kind', 'hits', 'misses'])
+    stats['hit_rate'] = (stats['hits'] / (stats['hits'] + stats['misses'])).round(3)
+    return stats
+
+
+def debug_enabled():
+    """Checking whether the timings panel is requested"""
+    if os.environ.get(DEBUG_ENV_VAR):
+        return True
+    try:
+        return st.query_params.get("debug") == "1"
+    except Exception:
+        return False
+
+
+def finish_rerun():
+    """Logging the stage timings of the current rerun and showing them in the sidebar in debug mode"""
+    records = getattr(_rerun, 'records', None)
+    if records is None:
+        return
+
+    page = _rerun.page
+    total = time.perf_counter() - _rerun.started
+    _rerun.records = None
+
+    logger.info(json.dumps({'page': page, 'total_seconds': round(total, 6), 'stages': records}, default=str))
+
+    metrics_file = os.environ.get(METRICS_FILE_ENV_VAR)
+    if metrics_file:
+        try:
+            write_metrics_file(metrics_file)
+        except OSError:
+            logger.warning("Could not write the metrics file %s", metrics_file, exc_info=True)
+
+    if not debug_enabled():
+        return
+
+    with st.sidebar.expander("Rerun Timings", expanded=True):
+        st.write(f"**{page}:** {total * 1000:.1f} ms")
+        timings_df = pd.DataFrame(records, columns=['stage', 'seconds', 'rows'])
+        timings_df['rows'] = timings_df['rows'].astype('Int64')
+        timings_df['ms'] = (timings_df.pop('seconds') * 1000).round(2)
+        st.dataframe(timings_df, hide_index=True)
+        st.write("**Cache lookups**")
+        st.dataframe(cache_stats(), hide_index=True)
+        st.code(metrics_text(), language='text')
+
+
+def metrics_text():
+    """Dumping the process-wide stage totals in the Prometheus text format"""
+    with _totals_lock:
+        totals = sorted(_totals.items())
+        lookups = sorted(_cache_lookups.items())
+
+    lines = []
+    for metric, position, kind, help_text in [
+        ('air_quality_stage_calls_total', 0, 'counter', "Number of times a stage ran"),
+        ('air_quality_stage_seconds_total', 1, 'counter', "Total wall time spent in a stage"),
+        ('air_quality_stage_rows_total', 2, 'counter', "Total rows produced by a stage"),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for (page, name), values in totals:
+            lines.append(f'{metric}{{page="{page}",stage="{name}"}} {values[position]}')
+
+    for metric, position, help_text in [
+        ('air_quality_cache_hits_total', 0, "Number of shared cache lookups served from the cache"),
+        ('air_quality_cache_misses_total', 1, "Number of shared cache lookups that built the value"),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for kind, values in lookups:
+            lines.append(f'{metric}{{kind="{kind}"}} {values[position]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path):
+    """Writing metrics_text() to path, replacing it at once so scrapers never read a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(metrics_text())
+    os.replace(tmp_path, path)
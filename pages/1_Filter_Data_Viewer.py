@@ -1,159 +1,214 @@
 import streamlit as st
 import pandas as pd
-import pandasql as ps
-from utils import load_clean_data
+from backends import count_data, load_data_options, page_data, query_data
+from export import EXPORT_FORMATS, export_button
+from instrumentation import finish_rerun, stage, start_rerun
+from query import describe_filters, normalize_query
+from warmup import wait_for_warmup
+
+# Rows per page of the results table
+TABLE_PAGE_SIZES = [25, 50, 100, 250, 500, 1000]
+TABLE_PAGE_SIZE = 100
 
 st.set_page_config(page_title="Filters Data Viewer", layout="wide")
+start_rerun("Filters Data Viewer")
 
 st.title("Filters Data Viewer")
 
-# Loading cleaned df from session_state
-if 'df_clean' not in st.session_state:
-    load_clean_data()
-df_clean = st.session_state.df_clean
-
-### Filter options
-st.subheader("Filter Options")
-use_city_filter = st.checkbox("Filter by City")
-use_date_filter = st.checkbox("Filter by Date Range")
-use_aqi_filter = st.checkbox("Filter by AQI Range")
-use_pm25_filter = st.checkbox("Filter by PM2.5 Range")
-use_co_filter = st.checkbox("Filter by CO Range")
-use_no2_filter = st.checkbox("Filter by NO2 Range")
-use_so2_filter = st.checkbox("Filter by SO2 Range")
-use_o3_filter = st.checkbox("Filter by O3 Range")
-use_pm10_filter = st.checkbox("Filter by PM10 Range")
-
-### Now the actual form → will run only on Search click
-with st.form(key='data_filter_form'):
-    st.subheader("Select Filters")
-
-    # City
-    if use_city_filter:
-        city_options = sorted(df_clean['City'].unique().tolist())
-        selected_cities = st.multiselect("Select Cities", city_options, default=city_options[0])
-
-    # Date range
-    if use_date_filter:
-        min_date = df_clean['Date'].min().date()
-        max_date = df_clean['Date'].max().date()
-        date_range = st.date_input("Select Date Range", value=[min_date, max_date], min_value=min_date, max_value=max_date)
-
-    # AQI
-    if use_aqi_filter:
-        aqi_min = st.number_input("Min AQI", value=float(df_clean['AQI'].min()), step=1.0)
-        aqi_max = st.number_input("Max AQI", value=float(df_clean['AQI'].max()), step=1.0)
-
-    # PM2.5
-    if use_pm25_filter:
-        pm25_min = st.number_input("Min PM2.5", value=float(df_clean['PM2.5'].min()), step=0.1)
-        pm25_max = st.number_input("Max PM2.5", value=float(df_clean['PM2.5'].max()), step=0.1)
-
-    # CO
-    if use_co_filter:
-        co_min = st.number_input("Min CO", value=float(df_clean['CO'].min()), step=1.0)
-        co_max = st.number_input("Max CO", value=float(df_clean['CO'].max()), step=1.0)
-
-    # NO2
-    if use_no2_filter:
-        no2_min = st.number_input("Min NO2", value=float(df_clean['NO2'].min()), step=0.1)
-        no2_max = st.number_input("Max NO2", value=float(df_clean['NO2'].max()), step=0.1)
-
-    # SO2
-    if use_so2_filter:
-        so2_min = st.number_input("Min SO2", value=float(df_clean['SO2'].min()), step=0.1)
-        so2_max = st.number_input("Max SO2", value=float(df_clean['SO2'].max()), step=0.1)
-
-    # O3
-    if use_o3_filter:
-        o3_min = st.number_input("Min O3", value=float(df_clean['O3'].min()), step=0.1)
-        o3_max = st.number_input("Max O3", value=float(df_clean['O3'].max()), step=0.1)
-
-    # PM10
-    if use_pm10_filter:
-        pm10_min = st.number_input("Min PM10", value=float(df_clean['PM10'].min()), step=0.1)
-        pm10_max = st.number_input("Max PM10", value=float(df_clean['PM10'].max()), step=0.1)
-
-    # Submit button
-    submit_button = st.form_submit_button(label='Search')
-
-### When user clicks Search
-if submit_button:
-    where_clauses = []
-
-    # City
-    if use_city_filter:
-        cities_str = "', '".join(selected_cities)
-        where_clauses.append(f"City IN ('{cities_str}')")
-
-    # Date range
-    if use_date_filter:
-        start_date = pd.to_datetime(date_range[0])
-        end_date = pd.to_datetime(date_range[1])
-        where_clauses.append(f"Date >= '{start_date}' AND Date <= '{end_date}'")
-
-    # AQI
-    if use_aqi_filter:
-        where_clauses.append(f"AQI >= {aqi_min} AND AQI <= {aqi_max}")
-
-    # PM2.5
-    if use_pm25_filter:
-        where_clauses.append(f"`PM2.5` >= {pm25_min} AND `PM2.5` <= {pm25_max}")
-
-    # CO
-    if use_co_filter:
-        where_clauses.append(f"CO >= {co_min} AND CO <= {co_max}")
-
-    # NO2
-    if use_no2_filter:
-        where_clauses.append(f"NO2 >= {no2_min} AND NO2 <= {no2_max}")
-
-    # SO2
-    if use_so2_filter:
-        where_clauses.append(f"SO2 >= {so2_min} AND SO2 <= {so2_max}")
-
-    # O3
-    if use_o3_filter:
-        where_clauses.append(f"O3 >= {o3_min} AND O3 <= {o3_max}")
-
-    # PM10
-    if use_pm10_filter:
-        where_clauses.append(f"`PM10` >= {pm10_min} AND `PM10` <= {pm10_max}")
-
-    # Build final SQL query
-    where_clause_str = " AND ".join(where_clauses)
-    if where_clause_str:
-        sql_query = f"SELECT * FROM df_clean WHERE {where_clause_str}"
-    else:
-        sql_query = "SELECT * FROM df_clean"  # No filters applied
-
-    # Run query
-    filtered_df = ps.sqldf(sql_query, locals())
+# Waiting for the background warm-up of the shared data (other sessions' work is never repeated)
+if not wait_for_warmup():
+    finish_rerun()
+    st.stop()
+
+# Loading the filter options (the data itself is loaded for the submitted selection)
+options = load_data_options()
+
+### Filter options and form (toggling a checkbox reruns only this part)
+@st.fragment
+def filter_form():
+    st.subheader("Filter Options")
+    use_city_filter = st.checkbox("Filter by City")
+    use_date_filter = st.checkbox("Filter by Date Range")
+    use_aqi_filter = st.checkbox("Filter by AQI Range")
+    use_pm25_filter = st.checkbox("Filter by PM2.5 Range")
+    use_co_filter = st.checkbox("Filter by CO Range")
+    use_no2_filter = st.checkbox("Filter by NO2 Range")
+    use_so2_filter = st.checkbox("Filter by SO2 Range")
+    use_o3_filter = st.checkbox("Filter by O3 Range")
+    use_pm10_filter = st.checkbox("Filter by PM10 Range")
+
+    ### Now the actual form → will run only on Search click
+    with st.form(key='data_filter_form'):
+        st.subheader("Select Filters")
+
+        # City
+        if use_city_filter:
+            city_options = sorted(options['cities'])
+            selected_cities = st.multiselect("Select Cities", city_options, default=city_options[0])
+
+        # Date range
+        if use_date_filter:
+            min_date = options['min_date']
+            max_date = options['max_date']
+            date_range = st.date_input("Select Date Range", value=[min_date, max_date], min_value=min_date, max_value=max_date)
+
+        # AQI
+        if use_aqi_filter:
+            aqi_min = st.number_input("Min AQI", value=options['ranges']['AQI'][0], step=1.0)
+            aqi_max = st.number_input("Max AQI", value=options['ranges']['AQI'][1], step=1.0)
+
+        # PM2.5
+        if use_pm25_filter:
+            pm25_min = st.number_input("Min PM2.5", value=options['ranges']['PM2.5'][0], step=0.1)
+            pm25_max = st.number_input("Max PM2.5", value=options['ranges']['PM2.5'][1], step=0.1)
+
+        # CO
+        if use_co_filter:
+            co_min = st.number_input("Min CO", value=options['ranges']['CO'][0], step=1.0)
+            co_max = st.number_input("Max CO", value=options['ranges']['CO'][1], step=1.0)
+
+        # NO2
+        if use_no2_filter:
+            no2_min = st.number_input("Min NO2", value=options['ranges']['NO2'][0], step=0.1)
+            no2_max = st.number_input("Max NO2", value=options['ranges']['NO2'][1], step=0.1)
+
+        # SO2
+        if use_so2_filter:
+            so2_min = st.number_input("Min SO2", value=options['ranges']['SO2'][0], step=0.1)
+            so2_max = st.number_input("Max SO2", value=options['ranges']['SO2'][1], step=0.1)
+
+        # O3
+        if use_o3_filter:
+            o3_min = st.number_input("Min O3", value=options['ranges']['O3'][0], step=0.1)
+            o3_max = st.number_input("Max O3", value=options['ranges']['O3'][1], step=0.1)
+
+        # PM10
+        if use_pm10_filter:
+            pm10_min = st.number_input("Min PM10", value=options['ranges']['PM10'][0], step=0.1)
+            pm10_max = st.number_input("Max PM10", value=options['ranges']['PM10'][1], step=0.1)
+
+        # Export format
+        export_format = st.selectbox("Export Format", list(EXPORT_FORMATS))
+
+        # Submit button
+        submit_button = st.form_submit_button(label='Search')
+
+    ### When user clicks Search
+    if submit_button:
+        cities = None
+        dates = None
+        ranges = {}
+
+        # City
+        if use_city_filter:
+            cities = selected_cities
+
+        # Date range
+        if use_date_filter:
+            start_date = pd.to_datetime(date_range[0])
+            end_date = pd.to_datetime(date_range[1])
+            dates = (start_date, end_date)
+
+        # AQI
+        if use_aqi_filter:
+            ranges['AQI'] = (aqi_min, aqi_max)
+
+        # PM2.5
+        if use_pm25_filter:
+            ranges['PM2.5'] = (pm25_min, pm25_max)
+
+        # CO
+        if use_co_filter:
+            ranges['CO'] = (co_min, co_max)
+
+        # NO2
+        if use_no2_filter:
+            ranges['NO2'] = (no2_min, no2_max)
+
+        # SO2
+        if use_so2_filter:
+            ranges['SO2'] = (so2_min, so2_max)
+
+        # O3
+        if use_o3_filter:
+            ranges['O3'] = (o3_min, o3_max)
+
+        # PM10
+        if use_pm10_filter:
+            ranges['PM10'] = (pm10_min, pm10_max)
 
-    # Show results
-    st.subheader("Filtered Air Quality Data")
-    st.write(f"**Filters applied:** {where_clause_str if where_clause_str else 'None'}")
-    st.dataframe(filtered_df)
+        # Build dynamic filename
+        filename_parts = ["filtered_air_quality"]
+
+        if use_city_filter:
+            cities_str_for_filename = "_".join([city.replace(" ", "_") for city in selected_cities])
+            filename_parts.append(cities_str_for_filename)
+
+        if use_date_filter:
+            filename_parts.append(f"{start_date.date()}_to_{end_date.date()}")
+
+        final_filename = "_".join(filename_parts)
+
+        # Keeping the submitted query across the reruns of the table controls, starting again from page 1
+        st.session_state['filter_query'] = (cities, dates, ranges, final_filename, export_format)
+        st.session_state['filter_page'] = 1
 
-    # Build dynamic filename
-    filename_parts = ["filtered_air_quality"]
+        # Rerunning the whole page to show the new results
+        st.rerun()
 
-    if use_city_filter:
-        cities_str_for_filename = "_".join([city.replace(" ", "_") for city in selected_cities])
-        filename_parts.append(cities_str_for_filename)
 
-    if use_date_filter:
-        filename_parts.append(f"{start_date.date()}_to_{end_date.date()}")
+filter_form()
 
-    final_filename = "_".join(filename_parts) + ".csv"
+### Results of the last search, paged on the server (the table controls rerun only this part)
+@st.fragment
+def filter_results():
+    cities, dates, ranges, final_filename, export_format = st.session_state['filter_query']
 
-    # Export CSV button
-    csv_data = filtered_df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="Export Filtered Data to CSV",
-        data=csv_data,
+    # Counting the matches without building them
+    with stage("count") as timing:
+        total_rows = count_data(cities, dates, ranges)
+        timing['rows'] = total_rows
+
+    # Show results
+    st.subheader("Filtered Air Quality Data")
+    st.write(f"**Filters applied:** {describe_filters(cities, dates, ranges)}")
+
+    # Table controls (a new sort or page size starts again from page 1)
+    def reset_page():
+        st.session_state['filter_page'] = 1
+
+    sort_column, order_column, size_column, page_column = st.columns(4)
+    sort_by = sort_column.selectbox("Sort By", ["None", "Date", "City"] + list(options['ranges']), key='filter_sort_by', on_change=reset_page)
+    descending = order_column.selectbox("Order", ["Ascending", "Descending"], key='filter_order', on_change=reset_page) == "Descending"
+    page_size = size_column.selectbox("Rows per Page", TABLE_PAGE_SIZES, index=TABLE_PAGE_SIZES.index(TABLE_PAGE_SIZE),
+                                      key='filter_page_size', on_change=reset_page)
+    page_count = max(-(-total_rows // page_size), 1)
+    if st.session_state.get('filter_page', 1) > page_count:
+        st.session_state['filter_page'] = page_count
+    page = page_column.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, step=1, key='filter_page')
+
+    # Fetching only the requested page, sorted on the server
+    with stage("page") as timing:
+        page_df = page_data(cities, dates, ranges, None if sort_by == "None" else sort_by, not descending, int(page), page_size)
+        timing['rows'] = len(page_df)
+    with stage("render_table", rows=len(page_df)):
+        st.dataframe(page_df)
+    if total_rows:
+        st.caption(f"Rows {page_df.index[0] + 1} to {page_df.index[-1] + 1} of {total_rows}.")
+
+    # Export button (the full result is only queried and encoded when clicked)
+    export_button(
+        label=f"Export Filtered Data to {export_format}",
+        df=lambda: query_data(cities, dates, ranges),
         file_name=final_filename,
-        mime="text/csv"
+        query_key=normalize_query(cities, dates, ranges, view="filtered"),
+        export_format=export_format
     )
 
-    st.success(f"Found {len(filtered_df)} records.")
+    st.success(f"Found {total_rows} records.")
+
+
+if 'filter_query' in st.session_state:
+    filter_results()
+
+finish_rerun()
@@ -1,147 +1,316 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from utils import load_clean_data
+from backends import correlate_data, load_data_options, query_data, resample_data, summarize_data
+from charts import LINE_CHART_MAX_POINTS, box_figure, cached_figure, downsample_series, scatter_figure
+from export import EXPORT_FORMATS, export_button
+from instrumentation import finish_rerun, stage, start_rerun
+from query import normalize_query
+from resample import AGGREGATORS, DEFAULT_PERCENTILE, GRANULARITIES, describe_aggregator
+from warmup import wait_for_warmup
 
 st.set_page_config(page_title="Data Visualization", layout="wide")
+start_rerun("Data Visualization")
 
-# Ensuring df_clean is initialized
-if 'df_clean' not in st.session_state:
-    load_clean_data()
+st.title("Data Visualization")
 
-df_clean = st.session_state.df_clean
+# Waiting for the background warm-up of the shared data (other sessions' work is never repeated)
+if not wait_for_warmup():
+    finish_rerun()
+    st.stop()
 
-st.title("Data Visualization")
+# Loading the filter options (the data itself is loaded for the submitted selection)
+options = load_data_options()
 
-# Visualization options
-st.subheader("Select Visualization Options")
-use_city_filter = st.checkbox("By City")
-use_date_filter = st.checkbox("By Date Range")
+# Visualization options and form (toggling a checkbox or the chart type reruns only this part)
+@st.fragment
+def visualization_form():
+    st.subheader("Select Visualization Options")
+    use_city_filter = st.checkbox("By City")
+    use_date_filter = st.checkbox("By Date Range")
 
-# Chart type selection
-chart_type = st.selectbox("Select Chart Type", ["Line Chart", "Bar Chart", "Boxplot", "Scatter Plot"])
+    # Chart type selection
+    chart_type = st.selectbox("Select Chart Type", ["Line Chart", "Bar Chart", "Boxplot", "Scatter Plot", "Correlation Matrix"])
 
-# Visualization form
-with st.form(key='visualization_form'):
-    st.subheader("Select Visualization Metric")
+    # Visualization form
+    with st.form(key='visualization_form'):
+        st.subheader("Select Visualization Metric")
 
-    # Metric selection based on chart type
-    if chart_type in ["Line Chart", "Bar Chart", "Boxplot"]:
-        selected_metric = st.selectbox("Select Metric", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
-    elif chart_type == "Scatter Plot":
-        selected_metric_x = st.selectbox("Select X-axis Metric", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
-        selected_metric_y = st.selectbox("Select Y-axis Metric", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
+        # Metric selection based on chart type
+        if chart_type in ["Line Chart", "Bar Chart", "Boxplot"]:
+            selected_metric = st.selectbox("Select Metric", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
+
+        # Time granularity and point budget per city for the Line Chart
+        if chart_type == "Line Chart":
+            granularity = st.selectbox("Granularity", ["Raw"] + list(GRANULARITIES))
+            aggregator = st.selectbox("Aggregate By", AGGREGATORS)
+            percentile = st.number_input("Percentile", min_value=1, max_value=99, value=DEFAULT_PERCENTILE)
+            max_points = st.number_input("Max Points per City", min_value=100, value=LINE_CHART_MAX_POINTS, step=100)
+
+        # Raw points for the Boxplot are opt-in
+        if chart_type == "Boxplot":
+            show_all_points = st.checkbox("Show All Points")
+        elif chart_type == "Scatter Plot":
+            selected_metric_x = st.selectbox("Select X-axis Metric", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
+            selected_metric_y = st.selectbox("Select Y-axis Metric", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
+            scatter_mode = st.selectbox("Render As", ["Auto", "Points", "Density"])
+
+        # City filter
+        if use_city_filter:
+            city_options = sorted(options['cities'])
+            selected_cities = st.multiselect("Select Cities", city_options, default=city_options[0])
+
+        # Date range filter
+        if use_date_filter:
+            min_date = options['min_date']
+            max_date = options['max_date']
+            date_range = st.date_input("Select Date Range", value=[min_date, max_date], min_value=min_date, max_value=max_date)
+
+        # Export format
+        export_format = st.selectbox("Export Format", list(EXPORT_FORMATS))
+
+        visualize_button = st.form_submit_button(label='Visualize')
+
+    if visualize_button:
+        # Applying filters
+        cities = selected_cities if use_city_filter else None
+        dates = None
+
+        if use_date_filter:
+            start_date = pd.to_datetime(date_range[0])
+            end_date = pd.to_datetime(date_range[1])
+            dates = (start_date, end_date)
+
+        # Keeping the submitted chart across reruns, then rerunning the whole page to show it
+        st.session_state['visualization_request'] = {
+            'chart_type': chart_type,
+            'cities': cities,
+            'dates': dates,
+            'metric': selected_metric if chart_type in ["Line Chart", "Bar Chart", "Boxplot"] else None,
+            'granularity': granularity if chart_type == "Line Chart" else None,
+            'aggregator': aggregator if chart_type == "Line Chart" else None,
+            'percentile': int(percentile) if chart_type == "Line Chart" else None,
+            'max_points': int(max_points) if chart_type == "Line Chart" else None,
+            'show_all_points': show_all_points if chart_type == "Boxplot" else None,
+            'metric_x': selected_metric_x if chart_type == "Scatter Plot" else None,
+            'metric_y': selected_metric_y if chart_type == "Scatter Plot" else None,
+            'scatter_mode': scatter_mode if chart_type == "Scatter Plot" else None,
+            'export_format': export_format,
+        }
+        st.rerun()
 
-    # City filter
-    if use_city_filter:
-        city_options = sorted(df_clean['City'].unique().tolist())
-        selected_cities = st.multiselect("Select Cities", city_options, default=city_options[0])
 
-    # Date range filter
-    if use_date_filter:
-        min_date = df_clean['Date'].min().date()
-        max_date = df_clean['Date'].max().date()
-        date_range = st.date_input("Select Date Range", value=[min_date, max_date], min_value=min_date, max_value=max_date)
+visualization_form()
 
-    visualize_button = st.form_submit_button(label='Visualize')
+# Chart of the last submitted request
+if 'visualization_request' in st.session_state:
+    # Loading plotting only once a chart is requested
+    import plotly.express as px
 
-# Visualization logic
-if visualize_button:
-    # Applying filters
-    filtered_df = df_clean.copy()
+    request = st.session_state['visualization_request']
+    chart_type = request['chart_type']
+    cities = request['cities']
+    dates = request['dates']
+    use_city_filter = cities is not None
+    selected_metric = request['metric']
+    granularity = request['granularity']
+    aggregator = request['aggregator']
+    percentile = request['percentile']
+    max_points = request['max_points']
+    show_all_points = request['show_all_points']
+    selected_metric_x = request['metric_x']
+    selected_metric_y = request['metric_y']
+    scatter_mode = request['scatter_mode']
+    export_format = request['export_format']
 
-    if use_city_filter:
-        filtered_df = filtered_df[filtered_df['City'].isin(selected_cities)]
+    # Querying the matching rows only for the charts drawing them (the others use aggregates of the backend)
+    if chart_type in ("Boxplot", "Scatter Plot") or (chart_type == "Line Chart" and granularity == "Raw"):
+        with stage("filter") as timing:
+            filtered_df = query_data(cities, dates)
+            timing['rows'] = len(filtered_df)
 
-    if use_date_filter:
-        start_date = pd.to_datetime(date_range[0])
-        end_date = pd.to_datetime(date_range[1])
-        filtered_df = filtered_df[(filtered_df['Date'] >= start_date) & (filtered_df['Date'] <= end_date)]
+    # Chart data exported below, the matching rows (queried only when exported) unless a chart replaces them
+    chart_data = None
+    chart_data_key = normalize_query(cities, dates, view="chart_data")
 
     # Showing resulting visualization chart
     st.subheader("Visualization Result")
 
     if chart_type == "Line Chart":
-        fig = px.line(
-            filtered_df,
-            x='Date',
-            y=selected_metric,
-            color='City' if use_city_filter else None,
-            title=f"{selected_metric} Trend Over Time"
-        )
-        fig.update_layout(
-            xaxis_title="Date",
-            yaxis_title=selected_metric,
-            legend_title="City" if use_city_filter else None
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        if granularity == "Raw":
+            series_df = filtered_df
+            title = f"{selected_metric} Trend Over Time"
+        else:
+            # Resampling each city series per period (cached per query and granularity)
+            with stage("resample") as timing:
+                series_df = resample_data(selected_metric, cities, dates, GRANULARITIES[granularity], aggregator, int(percentile))
+                timing['rows'] = len(series_df)
+            title = f"{granularity} {describe_aggregator(aggregator, int(percentile))} {selected_metric} Over Time"
+
+        def build_line_chart():
+            # Downsampling each city series, keeping the min/max of every bucket
+            line_df = downsample_series(series_df, selected_metric, int(max_points))
+            fig = px.line(
+                line_df,
+                x='Date',
+                y=selected_metric,
+                color='City' if use_city_filter else None,
+                title=title
+            )
+            fig.update_layout(
+                xaxis_title="Date",
+                yaxis_title=selected_metric,
+                legend_title="City" if use_city_filter else None
+            )
+            return fig, len(line_df)
+
+        with stage("build_figure") as timing:
+            figure_key = normalize_query(cities, dates, view="visualization", chart_type=chart_type, metric=selected_metric,
+                                         max_points=int(max_points), by_city=use_city_filter, granularity=granularity,
+                                         aggregator=aggregator, percentile=int(percentile))
+            fig, shown_points = cached_figure(figure_key, build_line_chart)
+            timing['rows'] = shown_points
+        with stage("render_chart"):
+            st.plotly_chart(fig, use_container_width=True)
+        if granularity == "Raw":
+            st.caption(f"Showing {shown_points} of {len(filtered_df)} points. Narrow the date range or pick a coarser granularity to see more detail.")
+        else:
+            st.caption(f"Showing {shown_points} {granularity.lower()} points summarizing {series_df['count'].sum()} readings.")
 
     elif chart_type == "Bar Chart":
-        avg_metric_df = filtered_df.groupby('City')[selected_metric].mean().reset_index().sort_values(by=selected_metric, ascending=False)
-        fig = px.bar(
-            avg_metric_df,
-            x='City',
-            y=selected_metric,
-            text_auto=True,
-            title=f"Average {selected_metric} by City"
-        )
-        fig.update_layout(
-            xaxis_title="City",
-            yaxis_title=f"Average {selected_metric}",
-            legend_title=None
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        with stage("summarize") as timing:
+            summary_df = summarize_data(selected_metric, cities, dates)
+            timing['rows'] = len(summary_df)
+
+        def build_bar_chart():
+            avg_metric_df = summary_df[['City', 'mean']].rename(columns={'mean': selected_metric}).sort_values(by=selected_metric, ascending=False)
+            fig = px.bar(
+                avg_metric_df,
+                x='City',
+                y=selected_metric,
+                text_auto=True,
+                title=f"Average {selected_metric} by City"
+            )
+            fig.update_layout(
+                xaxis_title="City",
+                yaxis_title=f"Average {selected_metric}",
+                legend_title=None
+            )
+            return fig,
+
+        with stage("build_figure"):
+            figure_key = normalize_query(cities, dates, view="visualization", chart_type=chart_type, metric=selected_metric)
+            fig, = cached_figure(figure_key, build_bar_chart)
+        with stage("render_chart"):
+            st.plotly_chart(fig, use_container_width=True)
 
     elif chart_type == "Boxplot":
-        fig = px.box(
-            filtered_df,
-            x='City',
-            y=selected_metric,
-            points="all",
-            title=f"{selected_metric} Distribution by City"
-        )
-        fig.update_layout(
-            xaxis_title="City",
-            yaxis_title=selected_metric,
-            legend_title="City" if use_city_filter else None
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        def build_boxplot():
+            # Summarizing boxes server-side unless all raw points are requested
+            if show_all_points:
+                fig = px.box(
+                    filtered_df,
+                    x='City',
+                    y=selected_metric,
+                    points="all",
+                    title=f"{selected_metric} Distribution by City"
+                )
+            else:
+                fig = box_figure(filtered_df, selected_metric, x='City')
+                fig.update_layout(title=f"{selected_metric} Distribution by City")
+            fig.update_layout(
+                xaxis_title="City",
+                yaxis_title=selected_metric,
+                legend_title="City" if use_city_filter else None
+            )
+            return fig,
+
+        with stage("build_figure"):
+            figure_key = normalize_query(cities, dates, view="visualization", chart_type=chart_type, metric=selected_metric,
+                                         show_all_points=show_all_points, by_city=use_city_filter)
+            fig, = cached_figure(figure_key, build_boxplot)
+        with stage("render_chart"):
+            st.plotly_chart(fig, use_container_width=True)
 
     elif chart_type == "Scatter Plot":
-        fig = px.scatter(
-            filtered_df,
-            x=selected_metric_x,
-            y=selected_metric_y,
-            color='City' if use_city_filter else None,
-            title=f"{selected_metric_y} vs {selected_metric_x}"
-        )
-        fig.update_layout(
-            xaxis_title=selected_metric_x,
-            yaxis_title=selected_metric_y,
-            legend_title="City" if use_city_filter else None
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        def build_scatter_plot():
+            # Switching to WebGL points or a density view on large selections
+            fig, render_mode = scatter_figure(
+                filtered_df,
+                x=selected_metric_x,
+                y=selected_metric_y,
+                color='City' if use_city_filter else None,
+                mode=scatter_mode
+            )
+            fig.update_layout(title=f"{selected_metric_y} vs {selected_metric_x}")
+            fig.update_layout(
+                xaxis_title=selected_metric_x,
+                yaxis_title=selected_metric_y,
+                legend_title="City" if use_city_filter else None
+            )
+            return fig, render_mode
+
+        with stage("build_figure"):
+            figure_key = normalize_query(cities, dates, view="visualization", chart_type=chart_type, x=selected_metric_x,
+                                         y=selected_metric_y, mode=scatter_mode, by_city=use_city_filter)
+            fig, render_mode = cached_figure(figure_key, build_scatter_plot)
+        with stage("render_chart"):
+            st.plotly_chart(fig, use_container_width=True)
+        if render_mode == "Density":
+            st.caption(f"{len(filtered_df)} points shown as a density view (point counts per bin).")
+
+    elif chart_type == "Correlation Matrix":
+        with stage("correlate") as timing:
+            correlation_df, reading_count = correlate_data(cities, dates)
+            timing['rows'] = reading_count
+
+        def build_correlation_matrix():
+            fig = px.imshow(
+                correlation_df,
+                text_auto='.2f',
+                zmin=-1,
+                zmax=1,
+                color_continuous_scale='RdBu_r',
+                title="Correlation Between Metrics"
+            )
+            fig.update_layout(
+                xaxis_title=None,
+                yaxis_title=None,
+                coloraxis_colorbar_title="Pearson r"
+            )
+            return fig,
+
+        with stage("build_figure"):
+            figure_key = normalize_query(cities, dates, view="visualization", chart_type=chart_type)
+            fig, = cached_figure(figure_key, build_correlation_matrix)
+        with stage("render_chart"):
+            st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"Pearson correlations over {reading_count} readings.")
+
+        chart_data = correlation_df.rename_axis('Metric').reset_index()
+        chart_data_key = normalize_query(cities, dates, view="chart_data", chart_type=chart_type)
 
     # Exporting chart data
     st.subheader("Export Chart Data")
-    chart_data_csv = filtered_df.to_csv(index=False).encode('utf-8')
 
     filename_parts = ["chart_data"]
 
-    if use_city_filter:
-        cities_str_for_filename = "_".join([city.replace(" ", "_") for city in selected_cities])
+    if cities is not None:
+        cities_str_for_filename = "_".join([city.replace(" ", "_") for city in cities])
         filename_parts.append(cities_str_for_filename)
 
-    if use_date_filter:
-        filename_parts.append(f"{start_date.date()}_to_{end_date.date()}")
+    if dates is not None:
+        filename_parts.append(f"{dates[0].date()}_to_{dates[1].date()}")
 
     filename_parts.append(chart_type.replace(" ", "_"))
 
-    final_chart_filename = "_".join(filename_parts) + ".csv"
+    final_chart_filename = "_".join(filename_parts)
 
-    st.download_button(
-        label="Export Chart Data to CSV",
-        data=chart_data_csv,
+    export_button(
+        label=f"Export Chart Data to {export_format}",
+        df=(lambda: query_data(cities, dates)) if chart_data is None else chart_data,
         file_name=final_chart_filename,
-        mime="text/csv"
+        query_key=chart_data_key,
+        export_format=export_format
     )
+
+finish_rerun()
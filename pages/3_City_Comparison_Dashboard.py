@@ -1,56 +1,83 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from utils import load_clean_data
+from analytics import AQI_CATEGORIES, EXCEEDANCE_LIMITS, ROLLING_WINDOWS
+from backends import category_data, exceedance_data, load_data_options, query_data, resample_data, summarize_data
+from charts import box_figure, cached_figure
+from export import EXPORT_FORMATS, export_button
+from instrumentation import finish_rerun, stage, start_rerun
+from query import normalize_query
+from resample import AGGREGATORS, DEFAULT_PERCENTILE, GRANULARITIES, describe_aggregator
+from warmup import wait_for_warmup
 
 st.set_page_config(page_title="Comparison Dashboard", layout="wide")
+start_rerun("City Comparison Dashboard")
 
-# Ensuring df_clean is initialized
-if 'df_clean' not in st.session_state:
-    load_clean_data()
+st.title("City Comparison Dashboard")
 
-df_clean = st.session_state.df_clean
+# Waiting for the background warm-up of the shared data (other sessions' work is never repeated)
+if not wait_for_warmup():
+    finish_rerun()
+    st.stop()
 
-st.title("City Comparison Dashboard")
+# Loading the filter options (the data itself is loaded for the submitted selection)
+options = load_data_options()
 
 # Date filter option
 use_date_filter = st.checkbox("Compare by Date Range")
 
 # Chart type selection outside form
-chart_type = st.selectbox("Select Chart Type", ["Bar Chart", "Boxplot", "Summary Table"])
+chart_type = st.selectbox("Select Chart Type", ["Bar Chart", "Boxplot", "Trend Chart", "Exceedance Analysis", "Summary Table"])
 
 # Comparison form
 with st.form(key='city_comparison_form'):
     st.subheader("Select Comparison Options")
 
     # City selection
-    city_options = sorted(df_clean['City'].unique().tolist())
+    city_options = sorted(options['cities'])
     selected_cities = st.multiselect("Select Cities to Compare", city_options, default=city_options[0])
 
     # Date range filter
     if use_date_filter:
-        min_date = df_clean['Date'].min().date()
-        max_date = df_clean['Date'].max().date()
+        min_date = options['min_date']
+        max_date = options['max_date']
         date_range = st.date_input("Select Date Range", value=[min_date, max_date], min_value=min_date, max_value=max_date)
 
     # Metric selection
     selected_metric = st.selectbox("Select Metric to Compare", ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'])
 
+    # Raw points for the Boxplot are opt-in
+    if chart_type == "Boxplot":
+        show_all_points = st.checkbox("Show All Points")
+
+    # Time granularity of the Trend Chart
+    if chart_type == "Trend Chart":
+        granularity = st.selectbox("Granularity", list(GRANULARITIES), index=list(GRANULARITIES).index("Daily"))
+        aggregator = st.selectbox("Aggregate By", AGGREGATORS)
+        percentile = st.number_input("Percentile", min_value=1, max_value=99, value=DEFAULT_PERCENTILE)
+
+    # Limit and averaging window of the Exceedance Analysis (guideline values of the metric by default)
+    if chart_type == "Exceedance Analysis":
+        limit = st.number_input("Exceedance Limit", min_value=0.0, value=None, placeholder="Guideline limit of the metric")
+        window = st.selectbox("Averaging Window", ["Guideline"] + [f"{hours}h" for hours in ROLLING_WINDOWS])
+
+    # Export format
+    export_format = st.selectbox("Export Format", list(EXPORT_FORMATS))
+
     compare_button = st.form_submit_button(label='Compare')
 
 # Comparison logic
 if compare_button:
-    # Apply filters
-    filtered_df = df_clean.copy()
+    # Loading plotting only once a chart is requested
+    import plotly.express as px
 
-    # Filter by city
-    filtered_df = filtered_df[filtered_df['City'].isin(selected_cities)]
+    # Apply filters
+    dates = None
 
     # Filter by date if enabled
     if use_date_filter:
         start_date = pd.to_datetime(date_range[0])
         end_date = pd.to_datetime(date_range[1])
-        filtered_df = filtered_df[(filtered_df['Date'] >= start_date) & (filtered_df['Date'] <= end_date)]
+        dates = (start_date, end_date)
 
     # Checking if at least two cities are selected
     if len(selected_cities) < 2:
@@ -63,53 +90,176 @@ if compare_button:
         # Displaying result
         st.subheader("Comparison Result")
 
+        # Chart options that change the exported data besides the metric
+        export_options = {}
+
         if chart_type == "Bar Chart":
-            avg_metric_df = filtered_df.groupby('City')[selected_metric].mean().reset_index().sort_values(by=selected_metric, ascending=False)
-            fig = px.bar(
-                avg_metric_df,
-                x='City',
-                y=selected_metric,
-                text_auto=True,
-                title=f"Average {selected_metric} by City"
-            )
-            fig.update_layout(
-                xaxis_title="City",
-                yaxis_title=f"Average {selected_metric}",
-                legend_title=None
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            with stage("summarize") as timing:
+                summary_df = summarize_data(selected_metric, selected_cities, dates)
+                timing['rows'] = len(summary_df)
+            avg_metric_df = summary_df[['City', 'mean']].rename(columns={'mean': selected_metric}).sort_values(by=selected_metric, ascending=False)
+
+            def build_bar_chart():
+                fig = px.bar(
+                    avg_metric_df,
+                    x='City',
+                    y=selected_metric,
+                    text_auto=True,
+                    title=f"Average {selected_metric} by City"
+                )
+                fig.update_layout(
+                    xaxis_title="City",
+                    yaxis_title=f"Average {selected_metric}",
+                    legend_title=None
+                )
+                return fig,
+
+            with stage("build_figure"):
+                figure_key = normalize_query(selected_cities, dates, view="comparison", chart_type=chart_type, metric=selected_metric)
+                fig, = cached_figure(figure_key, build_bar_chart)
+            with stage("render_chart"):
+                st.plotly_chart(fig, use_container_width=True)
 
             # Preparing chart data for export
-            chart_data = avg_metric_df.copy()
+            chart_data = avg_metric_df
 
         elif chart_type == "Boxplot":
-            fig = px.box(
-                filtered_df,
-                x='City',
-                y=selected_metric,
-                points="all",
-                title=f"{selected_metric} Distribution by City"
-            )
-            fig.update_layout(
-                xaxis_title="City",
-                yaxis_title=selected_metric,
-                legend_title="City"
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            # Filtering by city and date on the configured backend (the other charts use its aggregates)
+            with stage("filter") as timing:
+                filtered_df = query_data(selected_cities, dates)
+                timing['rows'] = len(filtered_df)
+
+            def build_boxplot():
+                # Summarizing boxes server-side unless all raw points are requested
+                if show_all_points:
+                    fig = px.box(
+                        filtered_df,
+                        x='City',
+                        y=selected_metric,
+                        points="all",
+                        title=f"{selected_metric} Distribution by City"
+                    )
+                else:
+                    fig = box_figure(filtered_df, selected_metric, x='City')
+                    fig.update_layout(title=f"{selected_metric} Distribution by City")
+                fig.update_layout(
+                    xaxis_title="City",
+                    yaxis_title=selected_metric,
+                    legend_title="City"
+                )
+                return fig,
+
+            with stage("build_figure"):
+                figure_key = normalize_query(selected_cities, dates, view="comparison", chart_type=chart_type, metric=selected_metric,
+                                             show_all_points=show_all_points)
+                fig, = cached_figure(figure_key, build_boxplot)
+            with stage("render_chart"):
+                st.plotly_chart(fig, use_container_width=True)
 
             # Preparing chart data for export
-            chart_data = filtered_df[['City', 'Date', selected_metric]].copy()
+            chart_data = filtered_df[['City', 'Date', selected_metric]]
+
+        elif chart_type == "Trend Chart":
+            # Resampling each city series per period (cached per query and granularity)
+            with stage("resample") as timing:
+                trend_df = resample_data(selected_metric, selected_cities, dates, GRANULARITIES[granularity], aggregator, int(percentile))
+                timing['rows'] = len(trend_df)
+            aggregate_label = describe_aggregator(aggregator, int(percentile))
+
+            def build_trend_chart():
+                fig = px.line(
+                    trend_df,
+                    x='Date',
+                    y=selected_metric,
+                    color='City',
+                    title=f"{granularity} {aggregate_label} {selected_metric} by City"
+                )
+                fig.update_layout(
+                    xaxis_title="Date",
+                    yaxis_title=f"{aggregate_label} {selected_metric}",
+                    legend_title="City"
+                )
+                return fig,
+
+            with stage("build_figure"):
+                figure_key = normalize_query(selected_cities, dates, view="comparison", chart_type=chart_type, metric=selected_metric,
+                                             granularity=granularity, aggregator=aggregator, percentile=int(percentile))
+                fig, = cached_figure(figure_key, build_trend_chart)
+            with stage("render_chart"):
+                st.plotly_chart(fig, use_container_width=True)
+
+            # Preparing chart data for export
+            chart_data = trend_df
+            export_options = dict(granularity=granularity, aggregator=aggregator, percentile=int(percentile))
+
+        elif chart_type == "Exceedance Analysis":
+            guideline_limit, guideline_hours = EXCEEDANCE_LIMITS[selected_metric]
+            limit = guideline_limit if limit is None else limit
+            hours = guideline_hours if window == "Guideline" else int(window.rstrip("h"))
+
+            with stage("summarize") as timing:
+                exceedance_df = exceedance_data(selected_metric, limit, hours, selected_cities, dates)
+                categories_df = category_data(selected_cities, dates)
+                timing['rows'] = len(exceedance_df)
+
+            def build_exceedance_chart():
+                fig = px.bar(
+                    exceedance_df,
+                    x='City',
+                    y='hours_above',
+                    text='episodes',
+                    title=f"Hours with the {hours}h Average {selected_metric} Above {limit:g}"
+                )
+                fig.update_traces(texttemplate="%{text} episodes")
+                fig.update_layout(
+                    xaxis_title="City",
+                    yaxis_title="Hours Above Limit",
+                    legend_title=None
+                )
+                return fig,
+
+            def build_category_chart():
+                fig = px.bar(
+                    categories_df,
+                    x='City',
+                    y='hours',
+                    color='Category',
+                    category_orders={'Category': list(AQI_CATEGORIES.values())},
+                    title="Hours per AQI Category by City"
+                )
+                fig.update_layout(
+                    xaxis_title="City",
+                    yaxis_title="Hours",
+                    legend_title="AQI Category"
+                )
+                return fig,
+
+            with stage("build_figure"):
+                figure_key = normalize_query(selected_cities, dates, view="comparison", chart_type=chart_type, metric=selected_metric,
+                                             limit=float(limit), hours=hours)
+                fig, = cached_figure(figure_key, build_exceedance_chart)
+                category_fig, = cached_figure(normalize_query(selected_cities, dates, view="comparison", chart_type="AQI Categories"),
+                                              build_category_chart)
+            with stage("render_chart"):
+                st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(exceedance_df)
+                st.plotly_chart(category_fig, use_container_width=True)
+
+            # Preparing chart data for export
+            chart_data = exceedance_df
+            export_options = dict(limit=float(limit), hours=hours)
 
         elif chart_type == "Summary Table":
-            summary_df = filtered_df.groupby('City')[selected_metric].agg(['count', 'mean', 'std', 'min', 'max']).reset_index()
+            with stage("summarize") as timing:
+                summary_df = summarize_data(selected_metric, selected_cities, dates)
+                timing['rows'] = len(summary_df)
             st.dataframe(summary_df)
 
             # Preparing chart data for export
-            chart_data = summary_df.copy()
+            chart_data = summary_df
 
         # Exporting comparison data
         st.subheader("Export Comparison Data")
-        chart_data_csv = chart_data.to_csv(index=False).encode('utf-8')
 
         filename_parts = ["city_comparison"]
 
@@ -122,11 +272,15 @@ if compare_button:
         filename_parts.append(chart_type.replace(" ", "_"))
         filename_parts.append(selected_metric)
 
-        final_chart_filename = "_".join(filename_parts) + ".csv"
+        final_chart_filename = "_".join(filename_parts)
 
-        st.download_button(
-            label="Export Comparison Data to CSV",
-            data=chart_data_csv,
+        export_button(
+            label=f"Export Comparison Data to {export_format}",
+            df=chart_data,
             file_name=final_chart_filename,
-            mime="text/csv"
+            query_key=normalize_query(selected_cities, dates, view="comparison", chart_type=chart_type, metric=selected_metric,
+                                      **export_options),
+            export_format=export_format
         )
+
+finish_rerun()
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+
+def build_city_index(df):
+    """Building the City index of df: city -> (start, stop) row range
+
+    df must be sorted by City then Date, so each city is one contiguous block of rows
+    whose dates can be bounded by binary search.
+    """
+    codes, cities = pd.factorize(df['City'])
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    stops = np.append(starts[1:], len(df))
+
+    if len(starts) != len(cities):
+        raise ValueError("Rows must be sorted by City to build the City index")
+
+    return {cities[codes[start]]: (int(start), int(stop)) for start, stop in zip(starts, stops)}
+
+
+def index_ranges(df, index, cities=None, date_range=None):
+    """Returning the (start, stop) row ranges of df for the given cities and inclusive date range"""
+    dates = df['Date'].to_numpy()
+    if date_range is not None:
+        start_date = pd.to_datetime(date_range[0]).to_datetime64()
+        end_date = pd.to_datetime(date_range[1]).to_datetime64()
+
+    selected = None if cities is None else set(cities)
+    ranges = []
+    for city, (start, stop) in index.items():
+        if selected is not None and city not in selected:
+            continue
+        if date_range is not None:
+            city_dates = dates[start:stop]
+            start, stop = (start + int(np.searchsorted(city_dates, start_date, side='left')),
+                           start + int(np.searchsorted(city_dates, end_date, side='right')))
+        if stop > start:
+            ranges.append((start, stop))
+
+    return ranges
+
+
+def select_data(df, index, cities=None, date_range=None):
+    """Slicing the rows of df for the given cities and date range via the City index"""
+    parts = [df.iloc[start:stop] for start, stop in index_ranges(df, index, cities, date_range)]
+    if not parts:
+        return df.iloc[0:0]
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts)
+
+
+def round_bound(value):
+    """Rounding a measure bound to the shortest decimal of its float32 value (4.45 rather than 4.449999809265137)"""
+    return float(str(np.float32(value)))
+
+
+def filter_mask(df, cities=None, date_range=None, ranges=None):
+    """Building the boolean row mask for the given City, Date and metric range predicates
+
+    cities is a list of city names, date_range an inclusive (start, end) pair and ranges
+    a dict of inclusive {column: (min, max)} bounds; None skips that predicate.
+    """
+    mask = np.ones(len(df), dtype=bool)
+
+    # City
+    if cities is not None:
+        mask &= df['City'].isin(cities).to_numpy()
+
+    # Date range
+    if date_range is not None:
+        start_date = pd.to_datetime(date_range[0]).to_datetime64()
+        end_date = pd.to_datetime(date_range[1]).to_datetime64()
+        dates = df['Date'].to_numpy()
+        mask &= (dates >= start_date) & (dates <= end_date)
+
+    # Metric ranges (bounds rounded to the precision of float columns, so an entered stored value matches itself)
+    for col, (low, high) in (ranges or {}).items():
+        values = df[col].to_numpy()
+        bound = values.dtype.type if values.dtype.kind == 'f' else np.float64
+        mask &= (values >= bound(low)) & (values <= bound(high))
+
+    return mask
+
+
+def filter_data(df, cities=None, date_range=None, ranges=None, index=None):
+    """Returning the rows of df matching all given predicates
+
+    With the City index of df, the City and Date predicates are answered by slicing
+    and only the metric ranges are evaluated as masks.
+    """
+    if index is not None:
+        df = select_data(df, index, cities, date_range)
+        cities = date_range = None
+
+    if cities is None and date_range is None and not ranges:
+        return df.reset_index(drop=True)
+
+    mask = filter_mask(df, cities, date_range, ranges)
+    return df[mask].reset_index(drop=True)
+
+
+def count_rows(df, cities=None, date_range=None, ranges=None, index=None):
+    """Counting the rows of df matching all given predicates without building the result"""
+    if index is None:
+        return int(filter_mask(df, cities, date_range, ranges).sum())
+
+    row_ranges = index_ranges(df, index, cities, date_range)
+    if not ranges:
+        return sum(stop - start for start, stop in row_ranges)
+    return sum(int(filter_mask(df.iloc[start:stop], ranges=ranges).sum()) for start, stop in row_ranges)
+
+
+def sort_order(df, sort_by, ascending=True):
+    """Returning the row positions of df sorted by a column (stable, so ties keep their current order)"""
+    return df[sort_by].reset_index(drop=True).sort_values(ascending=ascending, kind='stable').index.to_numpy()
+
+
+def page_rows(df, page, page_size, order=None):
+    """Returning page number page (from 1) of the rows of df in the given row order, indexed by row number"""
+    start = (page - 1) * page_size
+    stop = min(start + page_size, len(df))
+    positions = np.arange(start, stop) if order is None else order[start:stop]
+    page_df = df.take(positions)
+    page_df.index = pd.RangeIndex(start, start + len(page_df))
+    return page_df
+
+
+def describe_filters(cities=None, date_range=None, ranges=None):
+    """Describing the given predicates as text, or 'None' if nothing is filtered"""
+    parts = []
+
+    if cities is not None:
+        parts.append(f"City in ({', '.join(cities)})")
+
+    if date_range is not None:
+        start_date = pd.to_datetime(date_range[0])
+        end_date = pd.to_datetime(date_range[1])
+        parts.append(f"Date from {start_date.date()} to {end_date.date()}")
+
+    for col, (low, high) in (ranges or {}).items():
+        parts.append(f"{col} between {low} and {high}")
+
+    return " AND ".join(parts) if parts else "None"
+
+
+def normalize_query(cities=None, date_range=None, ranges=None, **options):
+    """Turning query parameters into a hashable key, equal for equivalent queries"""
+    if cities is not None:
+        cities = tuple(sorted(set(cities)))
+    if date_range is not None:
+        date_range = tuple(pd.to_datetime(d).isoformat() for d in date_range)
+    ranges = tuple(sorted((col, float(low), float(high)) for col, (low, high) in (ranges or {}).items()))
+    return (cities, date_range, ranges) + tuple(sorted(options.items()))
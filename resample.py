@@ -0,0 +1,58 @@
+import pandas as pd
+
+# Time granularities of resampled series: label -> period code
+GRANULARITIES = {
+    "Hourly": 'h',
+    "Daily": 'D',
+    "Weekly": 'W',
+    "Monthly": 'M',
+}
+
+# Aggregators of the readings within a period
+AGGREGATORS = ("Mean", "Max", "Percentile")
+
+# Default percentile for the Percentile aggregator
+DEFAULT_PERCENTILE = 95
+
+
+def floor_dates(dates, granularity):
+    """Flooring timestamps to the start of their hour ('h'), day ('D'), week starting Monday ('W') or month ('M')"""
+    if granularity in ('h', 'D'):
+        return dates.dt.floor(granularity)
+    if granularity == 'W':
+        days = dates.dt.floor('D')
+        return days - pd.to_timedelta(days.dt.dayofweek, unit='D')
+    if granularity == 'M':
+        return dates.dt.to_period('M').dt.to_timestamp().astype(dates.dtype)
+    raise ValueError(f"Unknown granularity {granularity!r}, expected one of {', '.join(GRANULARITIES.values())}")
+
+
+def resample_series(df, metric, granularity, aggregator="Mean", percentile=DEFAULT_PERCENTILE, by='City'):
+    """Resampling the readings of metric per city (or None for one series) into periods of the given granularity
+
+    Returns one row per city and period start (sorted by city then Date) with the
+    aggregated metric and the number of readings in the period.
+    """
+    if aggregator not in AGGREGATORS:
+        raise ValueError(f"Unknown aggregator {aggregator!r}, expected one of {', '.join(AGGREGATORS)}")
+
+    keys = ([df[by]] if by is not None else []) + [floor_dates(df['Date'], granularity).rename('Date')]
+    grouped = df[metric].astype('float64').groupby(keys, observed=True, sort=True)
+
+    if aggregator == "Mean":
+        values = grouped.mean()
+    elif aggregator == "Max":
+        values = grouped.max()
+    else:
+        values = grouped.quantile(percentile / 100)
+
+    resampled = pd.DataFrame({metric: values, 'count': grouped.size()})
+    return resampled.reset_index()
+
+
+def describe_aggregator(aggregator, percentile=DEFAULT_PERCENTILE):
+    """Describing an aggregator for chart titles, e.g. 'Mean' or '95th Percentile'"""
+    if aggregator != "Percentile":
+        return aggregator
+    suffix = "th" if 10 <= percentile % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(percentile % 10, "th")
+    return f"{percentile:g}{suffix} Percentile"
@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+
+from query import build_city_index
+
+# Measures with pre-aggregated rollups
+METRICS = ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3']
+
+# Mergeable statistics kept per metric, besides the row count
+STATS = ('sum', 'sumsq', 'min', 'max')
+
+ONE_NS = pd.Timedelta(1, 'ns')
+
+
+def metric_pairs(metrics=METRICS):
+    """Listing the pairs of distinct metrics with a cross-product column in the rollups"""
+    return [(a, b) for i, a in enumerate(metrics) for b in metrics[i + 1:]]
+
+
+def cross_column(a, b):
+    """Naming the rollup column holding the sum of the products of metrics a and b"""
+    return f"{a}_x_{b}"
+
+
+def _period_start(dates, level):
+    """Flooring timestamps to the start of their day ('D') or month ('M')"""
+    if level == 'D':
+        return dates.dt.floor('D')
+    return dates.dt.to_period('M').dt.to_timestamp().astype(dates.dtype)
+
+
+def build_rollup(df, level, metrics=METRICS):
+    """Aggregating df per City and day/month into count, sum, sum of squares, min and max of every metric
+    and the sum of products of every pair of metrics
+
+    The result is sorted by City then Date (the period start), so it can be sliced with
+    its own City index like the cleaned data.
+    """
+    values = df[metrics].astype('float64')
+    keys = [df['City'], _period_start(df['Date'], level).rename('Date')]
+
+    grouped = values.groupby(keys, observed=True, sort=True)
+    squared = (values * values).groupby(keys, observed=True, sort=True)
+
+    rollup = pd.DataFrame({'count': grouped.size()})
+    for metric in metrics:
+        rollup[f"{metric}_sum"] = grouped[metric].sum()
+        rollup[f"{metric}_sumsq"] = squared[metric].sum()
+        rollup[f"{metric}_min"] = grouped[metric].min()
+        rollup[f"{metric}_max"] = grouped[metric].max()
+
+    # Cross-products of every pair, so correlations of any selection can be merged from the rollups
+    codes = grouped.ngroup().to_numpy()
+    for a, b in metric_pairs(metrics):
+        products = values[a].to_numpy() * values[b].to_numpy()
+        rollup[cross_column(a, b)] = np.bincount(codes, weights=products, minlength=len(rollup))
+
+    return rollup.reset_index()
+
+
+def build_rollups(df, metrics=METRICS):
+    """Building the daily and monthly rollups of df with their City indexes"""
+    rollups = {}
+    for level in ('D', 'M'):
+        rollup = build_rollup(df, level, metrics)
+        rollups[level] = (rollup, build_city_index(rollup))
+    return rollups
+
+
+def _segments(start, end):
+    """Splitting the inclusive range [start, end] into whole months, whole days and partial-day edges
+
+    Returns (source, lo, hi) half-open segments where source is 'M' or 'D' for a rollup
+    level and 'raw' for rows of df.
+    """
+    if pd.isna(start) or pd.isna(end) or start > end:
+        return []
+
+    first_day = start.ceil('D')
+    last_day = (end + ONE_NS).floor('D')
+    if first_day >= last_day:
+        return [('raw', start, end + ONE_NS)]
+
+    segments = [('raw', start, first_day), ('raw', last_day, end + ONE_NS)]
+
+    first_month = first_day if first_day.day == 1 else (first_day.to_period('M') + 1).to_timestamp()
+    last_month = last_day.to_period('M').to_timestamp()
+    if first_month < last_month:
+        segments += [('M', first_month, last_month), ('D', first_day, first_month), ('D', last_month, last_day)]
+    else:
+        segments.append(('D', first_day, last_day))
+
+    return [(source, lo, hi) for source, lo, hi in segments if lo < hi]
+
+
+def _city_rows(source_index, dates, city, lo, hi):
+    """Returning the row range [i, j) of city with dates in [lo, hi) in a City-indexed source, empty if none"""
+    if city not in source_index:
+        return 0, 0
+    city_start, city_stop = source_index[city]
+    city_dates = dates[city_start:city_stop]
+    i = city_start + np.searchsorted(city_dates, lo.to_datetime64(), side='left')
+    j = city_start + np.searchsorted(city_dates, hi.to_datetime64(), side='left')
+    return i, j
+
+
+def _date_segments(df, date_range):
+    """Splitting an inclusive date range (the whole of df by default) into rollup and raw segments"""
+    if date_range is None:
+        start, end = df['Date'].min(), df['Date'].max()
+    else:
+        start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+    return _segments(start, end)
+
+
+def summarize_metric(df, index, rollups, metric, cities=None, date_range=None):
+    """Returning the count, mean, std, min and max of metric per city over an inclusive date range
+
+    Whole months and whole days inside the range are read from the rollups, and only the
+    partial days at its edges are read from the raw rows of df.
+    """
+    segments = _date_segments(df, date_range)
+
+    # Arrays per source: (dates, count, sum, sumsq, min, max) and the City index
+    sources = {}
+    for source, _, _ in segments:
+        if source in sources:
+            continue
+        if source == 'raw':
+            values = df[metric].to_numpy(dtype='float64')
+            sources[source] = (index, df['Date'].to_numpy(), None, values, None, values, values)
+        else:
+            rollup, rollup_index = rollups[source]
+            sources[source] = (rollup_index, rollup['Date'].to_numpy(), rollup['count'].to_numpy(),
+                               *(rollup[f"{metric}_{stat}"].to_numpy() for stat in STATS))
+
+    selected = None if cities is None else set(cities)
+    rows = []
+    for city in index:
+        if selected is not None and city not in selected:
+            continue
+
+        count, total, total_sq, low, high = 0, 0.0, 0.0, np.inf, -np.inf
+        for source, lo, hi in segments:
+            source_index, dates, counts, sums, sumsqs, mins, maxs = sources[source]
+            i, j = _city_rows(source_index, dates, city, lo, hi)
+            if i >= j:
+                continue
+
+            if counts is None:
+                # Raw rows: each one is its own count/sum/min/max
+                values = sums[i:j]
+                count += j - i
+                total += values.sum()
+                total_sq += np.dot(values, values)
+            else:
+                count += int(counts[i:j].sum())
+                total += sums[i:j].sum()
+                total_sq += sumsqs[i:j].sum()
+            low = min(low, mins[i:j].min())
+            high = max(high, maxs[i:j].max())
+
+        if count:
+            mean = total / count
+            std = np.sqrt(max(total_sq - total * mean, 0.0) / (count - 1)) if count > 1 else np.nan
+            rows.append((city, count, mean, std, low, high))
+
+    return pd.DataFrame(rows, columns=['City', 'count', 'mean', 'std', 'min', 'max'])
+
+
+def correlate_metrics(df, index, rollups, cities=None, date_range=None, metrics=METRICS):
+    """Returning the Pearson correlation matrix of metrics over the selected cities and inclusive date range
+
+    Counts, sums and cross-products of whole months and days are merged from the rollups,
+    and only the partial days at the range edges are read from the raw rows of df.
+    Returns the matrix (a DataFrame indexed by metric) and the number of readings.
+    """
+    segments = _date_segments(df, date_range)
+    pairs = metric_pairs(metrics)
+
+    # Arrays per source: (dates, count, statistics) with statistics = sums, sums of squares, cross-products
+    sources = {}
+    for source, _, _ in segments:
+        if source in sources:
+            continue
+        if source == 'raw':
+            sources[source] = (index, df['Date'].to_numpy(), None, df[metrics])
+        else:
+            rollup, rollup_index = rollups[source]
+            columns = ([f"{metric}_sum" for metric in metrics] + [f"{metric}_sumsq" for metric in metrics]
+                       + [cross_column(a, b) for a, b in pairs])
+            sources[source] = (rollup_index, rollup['Date'].to_numpy(), rollup['count'].to_numpy(),
+                               rollup[columns].to_numpy(dtype='float64'))
+
+    k = len(metrics)
+    count, sums, products = 0, np.zeros(k), np.zeros((k, k))
+    upper = np.triu_indices(k, 1)
+    selected = None if cities is None else set(cities)
+    for city in index:
+        if selected is not None and city not in selected:
+            continue
+        for source, lo, hi in segments:
+            source_index, dates, counts, stats = sources[source]
+            i, j = _city_rows(source_index, dates, city, lo, hi)
+            if i >= j:
+                continue
+
+            if counts is None:
+                # Raw rows: summing the values and their products directly
+                values = stats.iloc[i:j].to_numpy(dtype='float64')
+                count += j - i
+                sums += values.sum(axis=0)
+                products += values.T @ values
+            else:
+                totals = stats[i:j].sum(axis=0)
+                count += int(counts[i:j].sum())
+                sums += totals[:k]
+                products[np.diag_indices(k)] += totals[k:2 * k]
+                products[upper] += totals[2 * k:]
+                products.T[upper] += totals[2 * k:]
+
+    return pearson_matrix(count, sums, products, metrics), count
+
+
+def pearson_matrix(count, sums, products, metrics=METRICS):
+    """Turning the count, sums and matrix of sums of products of metrics into their Pearson correlation matrix"""
+    k = len(metrics)
+    matrix = np.full((k, k), np.nan)
+    if count > 1:
+        covariance = products - np.outer(sums, sums) / count
+        scale = np.sqrt(np.clip(np.diag(covariance), 0.0, None))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            matrix = np.clip(covariance / np.outer(scale, scale), -1.0, 1.0)
+    return pd.DataFrame(matrix, index=metrics, columns=metrics)
+
+
+def merge_rollups(rollups, new_rows, metrics=METRICS):
+    """Merging the rollups of new rows into existing rollups, combining periods present in both"""
+    merged = {}
+    for level, (rollup, _) in rollups.items():
+        combined = pd.concat([rollup, build_rollup(new_rows, level, metrics)], ignore_index=True)
+
+        aggregations = {'count': 'sum'}
+        for metric in metrics:
+            aggregations.update({f"{metric}_sum": 'sum', f"{metric}_sumsq": 'sum', f"{metric}_min": 'min', f"{metric}_max": 'max'})
+        aggregations.update({cross_column(a, b): 'sum' for a, b in metric_pairs(metrics)})
+
+        combined['City'] = combined['City'].astype('category')
+        rollup = combined.groupby(['City', 'Date'], observed=True, sort=True).agg(aggregations).reset_index()
+        merged[level] = (rollup, build_city_index(rollup))
+    return merged
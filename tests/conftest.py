@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the app modules from the repository root
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def app_directory(monkeypatch):
+    """Running each test from the repository root, where the app's default DATA_FILE is resolved"""
+    monkeypatch.chdir(ROOT)
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import backends
+import utils
+from analytics import AQI_CATEGORIES, category_hours, exceedance_summary, rolling_mean
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def make_dataset():
+    """Loading the cleaned dataset, whose series have gaps where outlier rows were dropped"""
+    return utils.clean_data(pd.read_csv(DATA_PATH))[0]
+
+
+def test_rolling_means_match_the_time_based_pandas_window():
+    df = make_dataset()
+    for hours in (8, 24):
+        naive = (df.set_index('Date').groupby('City', observed=True)['O3']
+                 .rolling(f"{hours}h").mean().to_numpy())
+        np.testing.assert_allclose(rolling_mean(df, 'O3', hours), naive, rtol=1e-9)
+
+
+def test_exceedances_match_a_loop_over_the_readings():
+    df = make_dataset()
+    summary = exceedance_summary(df, 'PM10', 20.0, hours=24).set_index('City')
+
+    for city, series in df.groupby('City', observed=True):
+        means = series.set_index('Date')['PM10'].astype('float64').rolling('24h').mean()
+
+        # Walking the readings: an episode continues while the next reading is one hour later and still above
+        episodes, previous = [], None
+        for date, above in zip(means.index, means > 20.0):
+            if above and previous is not None and date - previous == pd.Timedelta(hours=1):
+                episodes[-1] += 1
+            elif above:
+                episodes.append(1)
+            previous = date if above else None
+
+        row = summary.loc[city]
+        assert row['readings'] == len(series)
+        assert row['hours_above'] == sum(episodes)
+        assert row['episodes'] == len(episodes)
+        assert row['longest_hours'] == max(episodes, default=0)
+        assert np.isclose(row['mean_hours'], np.mean(episodes) if episodes else 0)
+
+
+def test_category_hours_match_the_binned_counts():
+    df = make_dataset()
+    hours = category_hours(df)
+
+    bins = list(AQI_CATEGORIES) + [np.inf]
+    categories = pd.cut(df['AQI'], bins, right=False, labels=list(AQI_CATEGORIES.values()))
+    naive = pd.crosstab(df['City'], categories, dropna=False)
+    assert list(hours['hours']) == list(naive.to_numpy().ravel())
+    assert hours['hours'].sum() == len(df)
+
+
+def test_city_selections_are_taken_from_the_all_cities_results():
+    cities = ['Cairo', 'London']
+    rows = backends.query_data(cities, backend='pandas')
+    pd.testing.assert_frame_equal(backends.exceedance_data('NO2', 25.0, 24, cities, backend='pandas'),
+                                  exceedance_summary(rows, 'NO2', 25.0, 24), check_categorical=False)
+    pd.testing.assert_frame_equal(backends.category_data(cities, backend='pandas'),
+                                  category_hours(rows), check_categorical=False)
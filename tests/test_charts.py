@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from charts import box_figure, box_stats, downsample_series
+
+
+def make_series(n=5000, seed=0):
+    """Building two noisy city series with a spike each, sorted by City then Date"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2024-01-01', periods=n, freq='h')
+    values = rng.normal(50, 10, size=2 * n)
+    values[1234] = 500.0
+    values[n + 4321] = -100.0
+    return pd.DataFrame({'Date': np.tile(dates, 2), 'City': np.repeat(['Cairo', 'Dubai'], n), 'AQI': values})
+
+
+def test_downsampling_keeps_the_extremes_of_every_bucket():
+    df = make_series()
+    sampled = downsample_series(df, 'AQI', max_points=100)
+
+    for city, series in df.groupby('City'):
+        kept = sampled[sampled['City'] == city]
+        assert len(kept) <= 102
+        assert kept['Date'].is_monotonic_increasing
+        assert kept['Date'].iloc[0] == series['Date'].iloc[0] and kept['Date'].iloc[-1] == series['Date'].iloc[-1]
+
+        # Every bucket of consecutive readings keeps its min and max
+        buckets = np.repeat(np.arange(50), np.diff(np.linspace(0, len(series), 51).astype(int)))
+        grouped = series['AQI'].groupby(buckets)
+        assert set(grouped.min()) <= set(kept['AQI']) and set(grouped.max()) <= set(kept['AQI'])
+
+    # Short series are kept whole
+    pd.testing.assert_frame_equal(downsample_series(df, 'AQI', max_points=10000), df)
+
+
+def test_box_stats_match_the_pandas_quartiles():
+    values = make_series()['AQI']
+    stats = box_stats(values, max_outliers=5)
+
+    q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    inside = values[values.between(low, high)]
+    outside = values[~values.between(low, high)]
+    assert np.allclose([stats['q1'], stats['median'], stats['q3']], [q1, median, q3])
+    assert stats['count'] == len(values)
+    assert (stats['lowerfence'], stats['upperfence']) == (inside.min(), inside.max())
+    assert len(stats['outliers']) == min(5, len(outside))
+    assert stats['outliers'][0] == outside.min() and stats['outliers'][-1] == outside.max()
+
+    fig = box_figure(make_series(), 'AQI', x='City')
+    assert list(fig.data[0].x) == ['Cairo', 'Dubai']
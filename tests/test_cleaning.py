@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def naive_outlier_filter(df_raw):
+    """Filtering like the original page did: one quantile call per column on the progressively filtered rows"""
+    df = df_raw.drop(columns=['CO2'])
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce').dt.tz_localize(None)
+    bounds = []
+    for col in df.select_dtypes(include='number').columns:
+        Q1 = df[col].quantile(0.25)
+        Q3 = df[col].quantile(0.75)
+        IQR = Q3 - Q1
+        lower_bound, upper_bound = Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
+        bounds.append((col, lower_bound, upper_bound))
+        df = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
+    return df, bounds
+
+
+def test_cleaning_keeps_the_rows_of_the_original_loop():
+    raw = pd.read_csv(DATA_PATH)
+    df_clean, bounds = utils.clean_data(raw)
+    filtered, naive_bounds = naive_outlier_filter(raw)
+
+    assert list(bounds['Column']) == [col for col, _, _ in naive_bounds]
+    np.testing.assert_allclose(bounds['Lower Bound'], [low for _, low, _ in naive_bounds], rtol=1e-12)
+    np.testing.assert_allclose(bounds['Upper Bound'], [high for _, _, high in naive_bounds], rtol=1e-12)
+    assert bounds['Rows Removed'].sum() == len(raw) - len(filtered)
+
+    naive = filtered.dropna().sort_values(['City', 'Date'], kind='stable').reset_index(drop=True)
+    assert len(df_clean) == len(naive)
+    assert (df_clean['City'].astype(str) == naive['City']).all()
+    assert (df_clean['Date'] == naive['Date']).all()
+
+    # Compact dtypes hold the same values (float32 ones to their own precision)
+    for col in bounds['Column']:
+        expected = naive[col].to_numpy()
+        if df_clean[col].dtype.kind == 'f':
+            expected = expected.astype(df_clean[col].dtype)
+        np.testing.assert_array_equal(df_clean[col].to_numpy(), expected)
@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+
+import dataset
+import utils
+from dataset import write_partitioned_dataset
+from query import filter_data
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def test_partitioned_selection_matches_the_csv(tmp_path, monkeypatch):
+    raw = pd.read_csv(DATA_PATH)
+    raw = raw[raw['City'].isin(['Cairo', 'Dubai'])]
+    csv_path = tmp_path / "subset.csv"
+    raw.to_csv(csv_path, index=False)
+    part_dir = write_partitioned_dataset(raw, str(tmp_path / "parts"))
+
+    listings = []
+    monkeypatch.setattr(utils, "list_partitions", lambda path: listings.append(path) or dataset.list_partitions(path))
+    utils.invalidate_data_cache()
+
+    partitioned, _ = utils.get_selection(path=part_dir)
+    expected, _ = utils.get_selection(path=str(csv_path))
+
+    # One directory listing serves the lookups and every partition build of the selection
+    assert len(listings) == 1
+    pd.testing.assert_frame_equal(filter_data(partitioned).astype({'City': str}),
+                                  filter_data(expected).astype({'City': str}))
+
+
+def test_stored_bounds_are_exact(tmp_path):
+    _, bounds = utils.clean_data(pd.read_csv(DATA_PATH))
+    dataset.write_bounds(str(tmp_path), "v1", bounds)
+    pd.testing.assert_frame_equal(dataset.read_bounds(str(tmp_path), "v1"), bounds, check_exact=True)
+
+
+def test_added_partitions_reclean_the_cached_ones(tmp_path, monkeypatch):
+    raw = pd.read_csv(DATA_PATH)
+    part_dir = write_partitioned_dataset(raw[raw['City'] == 'Cairo'], str(tmp_path / "parts"))
+    monkeypatch.setattr(utils, "PARTITIONS_LISTING_SECONDS", 0)
+    utils.invalidate_data_cache()
+    date_range = (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-02-29'))
+    utils.get_selection(['Cairo'], date_range, path=part_dir)
+
+    # New cities change the dataset bounds, so the Cairo partitions are cleaned again
+    write_partitioned_dataset(raw[raw['City'].isin(['Dubai', 'London'])], part_dir)
+    warm, _ = utils.get_selection(['Cairo'], date_range, path=part_dir)
+    version = utils.get_partitions(part_dir)[1]
+    assert all(key[2] == version for key in utils._data_cache if key[1] == part_dir)
+
+    utils.invalidate_data_cache()
+    fresh, _ = utils.get_selection(['Cairo'], date_range, path=part_dir)
+    pd.testing.assert_frame_equal(warm, fresh)
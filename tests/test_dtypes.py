@@ -0,0 +1,49 @@
+import os
+
+import pandas as pd
+
+import backends
+import utils
+from ingest import append_rows
+from query import build_city_index
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def test_duckdb_pages_keep_the_dataset_dtypes(tmp_path):
+    raw = pd.read_csv(DATA_PATH)
+    csv_path = tmp_path / "subset.csv"
+    raw[raw['City'].isin(['Cairo', 'London'])].to_csv(csv_path, index=False)
+    utils.invalidate_data_cache()
+
+    # The first page of the CO-sorted table only holds CO values that fit int8
+    expected = utils.get_clean_data(str(csv_path))[0].dtypes
+    for page in (1, 20, 40):
+        df = backends.duckdb_page(sort_by='CO', page=page, page_size=200, path=str(csv_path))
+        pd.testing.assert_series_equal(df.dtypes, expected)
+
+
+def test_appended_rows_keep_the_dtypes_unless_they_do_not_fit():
+    df = utils.compact_dtypes(pd.DataFrame({
+        'Date': pd.to_datetime(['2024-01-01 00:00', '2024-01-01 01:00']),
+        'City': ['Cairo', 'Cairo'],
+        'O3': [10.0, 12.0],
+    }))
+    index = build_city_index(df)
+    later = pd.Timestamp('2024-01-01 02:00')
+
+    merged = append_rows(df, index, pd.DataFrame({'Date': [later], 'City': ['Dubai'], 'O3': [11.0]}))
+    assert merged['O3'].dtype == 'int8'
+    assert list(merged['City'].cat.categories) == ['Cairo', 'Dubai']
+
+    # A fractional (or out of range) value needs a full rebuild deciding the dtypes anew
+    assert append_rows(df, index, pd.DataFrame({'Date': [later], 'City': ['Cairo'], 'O3': [11.5]})) is None
+    assert append_rows(df, index, pd.DataFrame({'Date': [later], 'City': ['Cairo'], 'O3': [300.0]})) is None
+
+
+def test_summaries_have_the_same_dtypes_on_both_backends():
+    for metric in ('AQI', 'CO'):
+        pandas_summary = backends.summarize_data(metric, ['Cairo', 'London'], backend='pandas')
+        duckdb_summary = backends.summarize_data(metric, ['Cairo', 'London'], backend='duckdb')
+        pd.testing.assert_series_equal(pandas_summary.dtypes, duckdb_summary.dtypes)
+        pd.testing.assert_frame_equal(pandas_summary, duckdb_summary, check_exact=False, rtol=1e-9)
@@ -0,0 +1,14 @@
+import gzip
+import io
+
+import pandas as pd
+
+from export import EXPORT_CHUNK_ROWS, export_bytes
+
+
+def test_exports_round_trip_across_chunks():
+    df = pd.DataFrame({'City': ['Cairo', 'Dubai'] * EXPORT_CHUNK_ROWS, 'AQI': [1.5, 2.25] * EXPORT_CHUNK_ROWS})
+
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(export_bytes(df, "CSV"))), df)
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(gzip.decompress(export_bytes(df, "CSV (gzip)")))), df)
+    pd.testing.assert_frame_equal(pd.read_parquet(io.BytesIO(export_bytes(df, "Parquet"))), df)
@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils
+from query import build_city_index, filter_data
+from rollups import METRICS, build_rollups, correlate_metrics
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def _split_raw(tmp_path):
+    """Writing the first months of two cities to a CSV, returning its path and the later raw rows"""
+    raw = pd.read_csv(DATA_PATH)
+    raw = raw[raw['City'].isin(['Cairo', 'London'])]
+    later = pd.to_datetime(raw['Date'], utc=True) >= pd.Timestamp('2024-11-15', tz='UTC')
+    csv_path = str(tmp_path / "subset.csv")
+    raw[~later].to_csv(csv_path, index=False)
+    return csv_path, raw[~later], raw[later]
+
+
+def _append(csv_path, rows):
+    """Appending raw rows to the CSV, moving its mtime forward so a new version is detected"""
+    rows.to_csv(csv_path, mode='a', header=False, index=False)
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def _assert_rollups_equal(actual, expected):
+    for level in expected:
+        pd.testing.assert_frame_equal(actual[level][0].astype({'City': str}), expected[level][0].astype({'City': str}),
+                                      check_exact=False, rtol=1e-9)
+        assert actual[level][1] == expected[level][1]
+
+
+def test_cache_file_keeps_the_exact_bounds(tmp_path):
+    csv_path, base, _ = _split_raw(tmp_path)
+    utils.invalidate_data_cache()
+
+    df_cached, bounds = utils._read_clean_cache(utils.materialize_clean_data(csv_path))
+    df_expected, bounds_expected = utils.clean_data(base)
+    pd.testing.assert_frame_equal(bounds, bounds_expected, check_exact=True)
+    pd.testing.assert_frame_equal(df_cached, df_expected, check_exact=True)
+
+
+def test_ingested_rows_match_cleaning_the_whole_file(tmp_path):
+    csv_path, base, appended = _split_raw(tmp_path)
+    utils.invalidate_data_cache()
+    _, bounds = utils.get_clean_data(csv_path)
+    utils.get_rollups(csv_path)
+
+    _append(csv_path, appended)
+    df_clean, new_bounds = utils.get_clean_data(csv_path)
+
+    # Incremental ingest keeps the bounds of the first version and cleans the appended rows with them
+    assert new_bounds is bounds
+    expected = utils.apply_outlier_bounds(utils.prepare_data(pd.concat([base, appended], ignore_index=True)), bounds).dropna()
+    expected = utils.compact_dtypes(expected.sort_values(['City', 'Date'], kind='stable').reset_index(drop=True))
+    pd.testing.assert_frame_equal(df_clean, expected, check_exact=True)
+
+    # Merged rollups equal rollups built over the whole cleaned data
+    _assert_rollups_equal(utils.get_rollups(csv_path), build_rollups(expected))
+
+
+def test_merged_rollups_correlate_like_the_rows(tmp_path):
+    csv_path, _, appended = _split_raw(tmp_path)
+    utils.invalidate_data_cache()
+    utils.get_rollups(csv_path)
+    _append(csv_path, appended)
+
+    df_clean = utils.get_clean_data(csv_path)[0]
+    rollups = utils.get_rollups(csv_path)
+    cases = [(None, None), (['Cairo'], (pd.Timestamp('2024-10-03 05:00'), pd.Timestamp('2024-12-20 17:00')))]
+    for cities, date_range in cases:
+        matrix, count = correlate_metrics(df_clean, build_city_index(df_clean), rollups, cities, date_range)
+        rows = filter_data(df_clean, cities, date_range)[METRICS].astype('float64')
+        assert count == len(rows)
+        np.testing.assert_allclose(matrix.to_numpy(), rows.corr().to_numpy(), atol=1e-8)
+
+
+def test_cache_file_replaces_those_of_older_versions(tmp_path):
+    csv_path, _, appended = _split_raw(tmp_path)
+    old_path = utils.materialize_clean_data(csv_path)
+    _append(csv_path, appended)
+
+    new_path = utils.materialize_clean_data(csv_path)
+    assert os.listdir(os.path.dirname(new_path)) == [os.path.basename(new_path)]
+    assert new_path != old_path
+
+
+def test_concurrent_appends_are_ingested_once(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    import ingest
+
+    csv_path, base, appended = _split_raw(tmp_path)
+    utils.invalidate_data_cache()
+    _, bounds = utils.get_clean_data(csv_path)
+
+    # Two appends seen as two file versions, built at the same time (e.g. by the warm-up and a session)
+    half = len(appended) // 2
+    _append(csv_path, appended.iloc[:half])
+    first = utils.source_version(csv_path)
+    _append(csv_path, appended.iloc[half:])
+    second = utils.source_version(csv_path)
+
+    running, overlaps = [], []
+    read_appended_rows = ingest.read_appended_rows
+
+    def slow_read(*args):
+        running.append(1)
+        overlaps.append(len(running))
+        time.sleep(0.2)
+        running.pop()
+        return read_appended_rows(*args)
+
+    monkeypatch.setattr(ingest, "read_appended_rows", slow_read)
+    params = (tuple(utils.DROP_COLUMNS), utils.IQR_MULTIPLIER)
+
+    def build(source):
+        utils._cached(("clean",) + source + params, lambda: utils._update_clean_data(csv_path, source, *params))
+
+    threads = [threading.Thread(target=build, args=(source,)) for source in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlaps) == 1
+    df_clean, new_bounds = utils.get_clean_data(csv_path)
+    assert new_bounds is bounds
+    expected = utils.apply_outlier_bounds(utils.prepare_data(pd.concat([base, appended], ignore_index=True)), bounds).dropna()
+    expected = utils.compact_dtypes(expected.sort_values(['City', 'Date'], kind='stable').reset_index(drop=True))
+    pd.testing.assert_frame_equal(df_clean, expected, check_exact=True)
+    state, = utils._ingest_states.values()
+    assert state['appended_rows'] == len(df_clean) - state['base_rows']
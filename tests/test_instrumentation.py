@@ -0,0 +1,16 @@
+import instrumentation
+from instrumentation import finish_rerun, stage, start_rerun
+
+
+def test_page_runs_rewrite_the_metrics_file(tmp_path, monkeypatch):
+    metrics_file = tmp_path / "air_quality.prom"
+    monkeypatch.setenv(instrumentation.METRICS_FILE_ENV_VAR, str(metrics_file))
+
+    start_rerun("Test Page")
+    with stage("filter", rows=3):
+        pass
+    finish_rerun()
+
+    text = metrics_file.read_text()
+    assert 'air_quality_stage_rows_total{page="Test Page",stage="filter"}' in text
+    assert list(tmp_path.iterdir()) == [metrics_file]
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils
+from query import build_city_index, count_rows, filter_data, round_bound, select_data
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def make_frame():
+    """Building a small cleaned-like frame with float32 and integer measures"""
+    return pd.DataFrame({
+        'Date': pd.to_datetime(['2024-01-01 00:00', '2024-01-01 01:00', '2024-01-01 02:00', '2024-01-01 00:00']),
+        'City': pd.Categorical(['Cairo', 'Cairo', 'Cairo', 'Dubai']),
+        'NO2': np.array([5.1, 20.3, 7.0, 5.0], dtype='float32'),
+        'CO': np.array([100, 200, 300, 400], dtype='int16'),
+    })
+
+
+def test_range_bounds_equal_to_stored_values_match():
+    df = make_frame()
+    ranges = {'NO2': (5.1, 20.3)}
+    assert list(filter_data(df, ranges=ranges)['NO2']) == list(np.array([5.1, 20.3, 7.0], dtype='float32'))
+    assert count_rows(df, ranges=ranges) == 3
+    assert count_rows(df, ranges=ranges, index=build_city_index(df)) == 3
+
+
+def test_integer_ranges_keep_exact_bounds():
+    df = make_frame()
+    assert count_rows(df, ranges={'CO': (200, 300)}) == 2
+    assert count_rows(df, ranges={'CO': (200.5, 300)}) == 1
+
+
+def test_round_bound_shows_the_shortest_float32_decimal():
+    assert round_bound(np.float32(4.45)) == 4.45
+    assert round_bound(4.449999809265137) == 4.45
+    assert np.float32(round_bound(np.float32(54.533333))) == np.float32(54.533333)
+
+
+def make_dataset():
+    """Loading a slice of the cleaned dataset (sorted by City then Date) with its City index"""
+    df = utils.clean_data(pd.read_csv(DATA_PATH))[0]
+    return df, build_city_index(df)
+
+
+def test_index_slicing_matches_the_naive_filter():
+    df, index = make_dataset()
+    cities = ['Cairo', 'London', 'Sydney']
+    date_range = (pd.Timestamp('2024-03-10 05:00'), pd.Timestamp('2024-04-02 17:30'))
+    ranges = {'PM2.5': (2.0, 15.5), 'CO': (100, 400)}
+
+    naive = df[df['City'].isin(cities) & df['Date'].between(*date_range)
+               & df['PM2.5'].between(*ranges['PM2.5']) & df['CO'].between(*ranges['CO'])].reset_index(drop=True)
+    assert len(naive)
+    for index_arg in (None, index):
+        pd.testing.assert_frame_equal(filter_data(df, cities, date_range, ranges, index=index_arg), naive)
+        assert count_rows(df, cities, date_range, ranges, index=index_arg) == len(naive)
+
+    # Slicing alone keeps exactly the rows of the city and date predicates
+    naive = df[df['City'].isin(cities) & df['Date'].between(*date_range)]
+    pd.testing.assert_frame_equal(select_data(df, index, cities, date_range), naive)
+    assert select_data(df, index, ['Nowhere']).empty
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils
+from resample import resample_series
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+# Period codes and the pandas Grouper periods starting at the same instants
+GROUPERS = {
+    'D': dict(freq='D'),
+    'W': dict(freq='W-MON', label='left', closed='left'),
+    'M': dict(freq='MS'),
+}
+
+
+def test_resampled_series_match_the_pandas_grouper():
+    df = utils.clean_data(pd.read_csv(DATA_PATH))[0]
+    df = df[df['City'].isin(['Cairo', 'Sydney'])]
+    readings = df.astype({'NO2': 'float64'})
+
+    for granularity, grouper in GROUPERS.items():
+        grouped = readings.groupby(['City', pd.Grouper(key='Date', **grouper)], observed=True)['NO2']
+
+        # The Grouper also lists the empty periods between readings
+        counts = grouped.size()
+        periods = counts > 0
+        for aggregator, naive in (("Mean", grouped.mean()), ("Max", grouped.max()), ("Percentile", grouped.quantile(0.9))):
+            resampled = resample_series(df, 'NO2', granularity, aggregator, percentile=90)
+            naive = naive[periods]
+
+            assert list(resampled['City']) == list(naive.index.get_level_values('City'))
+            assert list(resampled['Date']) == list(naive.index.get_level_values('Date'))
+            assert list(resampled['count']) == list(counts[periods])
+            np.testing.assert_allclose(resampled['NO2'], naive, rtol=1e-12)
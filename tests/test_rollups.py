@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils
+from query import build_city_index
+from rollups import METRICS, build_rollup, build_rollups, summarize_metric
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Air_Quality.csv")
+
+
+def make_dataset():
+    """Loading the cleaned dataset with its City index and rollups"""
+    df = utils.clean_data(pd.read_csv(DATA_PATH))[0]
+    return df, build_city_index(df), build_rollups(df)
+
+
+def test_rollups_match_the_grouped_sums():
+    df = make_dataset()[0]
+    rollup = build_rollup(df, 'M')
+
+    values = df[METRICS].astype('float64')
+    grouped = values.groupby([df['City'], df['Date'].dt.to_period('M').rename('Date')], observed=True)
+    assert list(rollup['count']) == list(grouped.size())
+    for metric in METRICS:
+        np.testing.assert_allclose(rollup[f"{metric}_sum"], grouped[metric].sum(), rtol=1e-12)
+        np.testing.assert_allclose(rollup[f"{metric}_sumsq"], (values[metric] ** 2).groupby(grouped.ngroup()).sum(), rtol=1e-12)
+        np.testing.assert_array_equal(rollup[f"{metric}_min"], grouped[metric].min())
+        np.testing.assert_array_equal(rollup[f"{metric}_max"], grouped[metric].max())
+    np.testing.assert_allclose(rollup['CO_x_NO2'], (values['CO'] * values['NO2']).groupby(grouped.ngroup()).sum(), rtol=1e-12)
+
+
+def test_summaries_match_the_grouped_aggregates():
+    df, index, rollups = make_dataset()
+    cities = ['Brasilia', 'Cairo', 'London']
+
+    # The whole data, then a range with partial days and months at both ends
+    for date_range in (None, (pd.Timestamp('2024-02-03 07:00'), pd.Timestamp('2024-09-17 13:30'))):
+        summary = summarize_metric(df, index, rollups, 'PM10', cities, date_range)
+
+        rows = df[df['City'].isin(cities)]
+        if date_range is not None:
+            rows = rows[rows['Date'].between(*date_range)]
+        naive = rows['PM10'].astype('float64').groupby(rows['City'], observed=True).agg(['count', 'mean', 'std', 'min', 'max'])
+
+        assert list(summary['City']) == list(naive.index)
+        assert list(summary['count']) == list(naive['count'])
+        for stat in ('mean', 'std', 'min', 'max'):
+            np.testing.assert_allclose(summary[stat], naive[stat], rtol=1e-9)
@@ -0,0 +1,27 @@
+import threading
+import time
+
+import warmup
+
+
+def test_pages_keep_loading_while_a_newer_version_warms_up(monkeypatch):
+    loaded, release = threading.Event(), threading.Event()
+    steps = [("Loading", loaded.set), ("Slow step", release.wait)]
+    versions = iter([("data.csv", 1), ("data.csv", 2)])
+    monkeypatch.setattr(warmup, "warmup_steps", lambda path: steps)
+    monkeypatch.setattr(warmup, "source_version", lambda path: next(versions))
+    monkeypatch.setattr(warmup, "_warmup", {**warmup._warmup, 'source': None, 'ready': False})
+    monkeypatch.setenv(warmup.WARMUP_ENV_VAR, "1")
+
+    # Pages only wait for the data load, not for the steps behind it
+    warmup.start_warmup()
+    assert loaded.wait(5)
+    while not warmup.warmup_status()['ready']:
+        time.sleep(0.01)
+    assert not warmup.warmup_status()['finished']
+
+    # A new dataset version warms up behind the pages instead of sending them back to the progress screen
+    warmup.start_warmup()
+    status = warmup.warmup_status()
+    assert status['source'] == ("data.csv", 2) and status['ready']
+    release.set()
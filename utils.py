@@ -1,19 +1,585 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import streamlit as st
-import plotly.express as px
 import io
 
+from dataset import (is_partitioned, list_partitions, partitions_version, read_bounds, read_dtypes, read_partition, select_partitions,
+                     write_bounds)
+from instrumentation import record_cache, stage
+from query import build_city_index, round_bound
+from rollups import build_rollups, merge_rollups
+
+# Source dataset (a CSV file or a partitioned dataset directory) and cleaning defaults
+DATA_FILE = os.environ.get("AIR_QUALITY_DATA", "Air_Quality.csv")
+DROP_COLUMNS = ("CO2",)
+IQR_MULTIPLIER = 1.5
+
+# Outlier filtering modes (see filter_outliers), chosen with AIR_QUALITY_OUTLIER_MODE
+OUTLIER_MODES = ("sequential", "joint", "per_city")
+OUTLIER_MODE = os.environ.get("AIR_QUALITY_OUTLIER_MODE", "sequential")
+# Threads computing per-city bounds (None lets the pool choose)
+OUTLIER_WORKERS = None
+
+# Directory (next to the source file) holding the columnar cache of cleaned data
+DATA_CACHE_DIR = ".data_cache"
+# Bumped whenever the cleaning output changes, so stale cache files are not reused
+CLEAN_CACHE_VERSION = 4
+
+# Upper bound on the memory held by the shared data cache (all sessions together)
+DATA_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Share of rows appended since the last full clean after which bounds are recomputed
+INGEST_REFRESH_FRACTION = 0.25
+
+# Seconds a partitioned dataset's file listing (and so its version) is reused before listing the directory again
+PARTITIONS_LISTING_SECONDS = 2.0
+
+# Upper bound on the memory held by the shared query result cache (filtered frames, aggregates, figure JSON, exports)
+RESULT_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# Process-wide caches shared by every session: key -> (value, size in bytes)
+_data_cache = OrderedDict()
+_result_cache = OrderedDict()
+_data_cache_lock = threading.RLock()
+
+# Builds in progress: (id of cache, key) -> Future of the value
+_in_flight = {}
+
+# Latest file listing per partitioned dataset directory: path -> (listed at, partitions, version)
+_partition_listings = {}
+
+# Incremental ingest state per (source path, cleaning parameters), updated under its lock in _ingest_locks
+_ingest_states = {}
+_ingest_locks = {}
+
+
 def load_css(file_name):
     with open(file_name) as f:
         css = f.read()
     st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
 
 
+def get_partitions(path):
+    """Returning the shared partition listing of a dataset directory and its version
+
+    The directory is globbed at most once every PARTITIONS_LISTING_SECONDS, so the cache
+    lookups and partition builds of a rerun share one listing. When the listing changes,
+    the cached entries of older versions are dropped.
+    """
+    path = os.path.abspath(path)
+    now = time.monotonic()
+    with _data_cache_lock:
+        listed = _partition_listings.get(path)
+    if listed is not None and now - listed[0] < PARTITIONS_LISTING_SECONDS:
+        return listed[1], listed[2]
+
+    partitions = list_partitions(path)
+    version = partitions_version(path, partitions)
+    with _data_cache_lock:
+        previous = _partition_listings.get(path)
+        _partition_listings[path] = (now, partitions, version)
+    if previous is not None and previous[2] != version:
+        _drop_stale_versions(path, version)
+    return partitions, version
+
+
+def _source_key(path):
+    """Building the cache key part identifying a source version (path + mtime, or partitions version for a directory)"""
+    path = os.path.abspath(path)
+    if is_partitioned(path):
+        return path, get_partitions(path)[1]
+    return path, os.stat(path).st_mtime_ns
+
+
+def source_version(path=DATA_FILE):
+    """Returning the key of the current version of a source (path + mtime, or partitions version for a directory)"""
+    return _source_key(path)
+
+
+def _frame_nbytes(value):
+    """Estimating the memory held by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_frame_nbytes(v) for v in value.values())
+    if isinstance(value, tuple):
+        return sum(_frame_nbytes(v) for v in value)
+    return 0
+
+
+def _cached(key, build, cache=None):
+    """Returning the cached value for key (in the data cache unless another cache is given), building and storing it on a miss
+
+    Builds run outside the cache lock, so other keys stay available meanwhile; a miss on a
+    key already being built (by another session or the warm-up) waits for that build instead
+    of repeating it.
+    """
+    cache = _data_cache if cache is None else cache
+    with _data_cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            record_cache(key[0], hit=True)
+            return cache[key][0]
+
+        record_cache(key[0], hit=False)
+        pending = _in_flight.get((id(cache), key))
+        if pending is None:
+            pending = _in_flight[(id(cache), key)] = Future()
+            building = True
+        else:
+            building = False
+
+    if not building:
+        return pending.result()
+
+    try:
+        value = build()
+    except BaseException as error:
+        pending.set_exception(error)
+        raise
+    else:
+        _store(key, value, cache)
+        pending.set_result(value)
+        return value
+    finally:
+        with _data_cache_lock:
+            del _in_flight[(id(cache), key)]
+
+
+def _store(key, value, cache=None):
+    """Storing a value in a shared cache, evicting least recently used entries above that cache's memory budget"""
+    cache = _data_cache if cache is None else cache
+    max_bytes = RESULT_CACHE_MAX_BYTES if cache is _result_cache else DATA_CACHE_MAX_BYTES
+    with _data_cache_lock:
+        cache[key] = (value, _frame_nbytes(value))
+        cache.move_to_end(key)
+
+        # Never evicting the newest entry
+        while len(cache) > 1 and sum(size for _, size in cache.values()) > max_bytes:
+            cache.popitem(last=False)
+
+
+def _drop_stale_versions(path, mtime):
+    """Dropping cached entries and results of other versions of a source file"""
+    with _data_cache_lock:
+        for cache in (_data_cache, _result_cache):
+            for key in [k for k in cache if k[1] == path and k[2] != mtime]:
+                del cache[key]
+
+
+def invalidate_data_cache(path=None):
+    """Dropping cached datasets, results (and incremental ingest state) for one source file, or everything if path is None"""
+    with _data_cache_lock:
+        if path is None:
+            _data_cache.clear()
+            _result_cache.clear()
+            _ingest_states.clear()
+            _partition_listings.clear()
+            return
+        path = os.path.abspath(path)
+        for cache in (_data_cache, _result_cache):
+            for key in [k for k in cache if k[1] == path]:
+                del cache[key]
+        for key in [k for k in _ingest_states if k[0] == path]:
+            del _ingest_states[key]
+        _partition_listings.pop(path, None)
+
+
+def get_raw_data(path=DATA_FILE):
+    """Returning the shared raw DataFrame for path (read-only, parsed once per file version)
+
+    For a partitioned dataset only the first partition is read, as a sample of the raw data.
+    """
+    source = _source_key(path)
+    if is_partitioned(path):
+        first = get_partitions(path)[0].iloc[0]
+        return _cached(("raw",) + source, lambda: read_partition(first['path'], first['City']))
+    return _cached(("raw",) + source, lambda: pd.read_csv(path))
+
+
+def get_clean_data(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the shared cleaned DataFrame and outlier bounds report (read-only, cleaned once per file version and parameters)
+
+    For a partitioned dataset the df is the cleaned first partition (a sample) and the
+    bounds are those of the whole dataset; use get_selection() for the actual rows.
+    """
+    source = _source_key(path)
+    key = ("clean",) + source + (tuple(drop_columns), iqr_multiplier)
+    if is_partitioned(path):
+        def build():
+            listing = get_partitions(path)
+            bounds = _get_dataset_schema(path, drop_columns, iqr_multiplier, listing)[0]
+            return get_partition(path, listing[0].iloc[0], drop_columns, iqr_multiplier, listing), bounds
+
+        return _cached(key, build)
+    return _cached(key, lambda: _update_clean_data(path, source, drop_columns, iqr_multiplier))
+
+
+def _get_dataset_schema(path, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER, listing=None):
+    """Returning the shared outlier bounds report and column dtypes of a whole partitioned dataset, loaded once per dataset version
+
+    Read from the dataset's bounds file, or computed once over all partitions (exactly as
+    for a single CSV) and stored there for later processes. listing is the (partitions,
+    version) pair of get_partitions() to use, the current one unless given.
+    """
+    partitions, partitions_key = get_partitions(path) if listing is None else listing
+
+    def build():
+        version = dataset_bounds_version(path, partitions, drop_columns, iqr_multiplier)
+        bounds, dtypes = read_bounds(path, version), read_dtypes(path, version)
+        if bounds is None or dtypes is None:
+            with stage("dataset_bounds", rows=len(partitions)):
+                df = prepare_data(pd.concat([read_partition(file, city) for city, file in zip(partitions['City'], partitions['path'])],
+                                            ignore_index=True), drop_columns)
+                if bounds is None:
+                    df, bounds = filter_outliers(df, iqr_multiplier)
+                else:
+                    # Bounds stored without the dtypes (by the DuckDB backend)
+                    df = apply_outlier_bounds(df, bounds)
+                dtypes = schema_dtypes(df.dropna())
+            try:
+                write_bounds(path, version, bounds, dtypes)
+            except OSError:
+                # Read-only dataset directory, recomputing in the next process
+                pass
+        return bounds, dtypes
+
+    return _cached(("dataset_bounds", os.path.abspath(path), partitions_key, tuple(drop_columns), iqr_multiplier), build)
+
+
+def get_dataset_bounds(path, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the shared outlier bounds report of a whole partitioned dataset, loaded once per dataset version"""
+    return _get_dataset_schema(path, drop_columns, iqr_multiplier)[0]
+
+
+def dataset_bounds_version(path, partitions, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Identifying the stored bounds of a partitioned dataset by its partitions and cleaning parameters"""
+    return partitions_version(path, partitions) + json.dumps([CLEAN_CACHE_VERSION, list(drop_columns), iqr_multiplier, OUTLIER_MODE])
+
+
+def get_partition(path, partition, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER, listing=None):
+    """Returning the shared cleaned rows of one partition (a row of the listing), cleaned with the bounds and dtypes of that dataset version
+
+    Adding partitions changes the dataset bounds, so the rows are cached per dataset version.
+    listing is the (partitions, version) pair of get_partitions(), the current one unless given.
+    """
+    partitions, version = get_partitions(path) if listing is None else listing
+    key = ("partition", os.path.abspath(path), version, partition['path'], partition['mtime_ns'], tuple(drop_columns), iqr_multiplier)
+
+    def build():
+        bounds, dtypes = _get_dataset_schema(path, drop_columns, iqr_multiplier, (partitions, version))
+        df = apply_outlier_bounds(prepare_data(read_partition(partition['path'], partition['City']), drop_columns), bounds).dropna()
+        return compact_dtypes(df.sort_values(['City', 'Date'], kind='stable').reset_index(drop=True), dtypes)
+
+    return _cached(key, build)
+
+
+def _select_partitions(path, cities, date_range):
+    """Returning the source key of a partitioned dataset and its partitions overlapping a City/Date selection"""
+    partitions, version = get_partitions(path)
+    return (os.path.abspath(path), version), select_partitions(partitions, cities, date_range)
+
+
+def get_selection(cities=None, date_range=None, path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the cleaned df and its City index holding (at least) the rows of a City/Date selection
+
+    For a single CSV this is the whole shared cleaned df. For a partitioned dataset only the
+    partitions overlapping the selection are read (each cleaned once and cached), so the
+    result still has to be filtered on the exact cities and dates.
+    """
+    if not is_partitioned(path):
+        return get_clean_data(path, drop_columns, iqr_multiplier)[0], get_city_index(path, drop_columns, iqr_multiplier)
+
+    # One listing for the key and all partitions of the selection, so they belong to the same dataset version
+    listing = get_partitions(path)
+    selected = select_partitions(listing[0], cities, date_range)
+    key = ("selection", os.path.abspath(path), listing[1], tuple(drop_columns), iqr_multiplier, tuple(selected['path']))
+
+    def build():
+        dtypes = _get_dataset_schema(path, drop_columns, iqr_multiplier, listing)[1]
+        frames = [get_partition(path, partition, drop_columns, iqr_multiplier, listing) for _, partition in selected.iterrows()]
+        if not frames:
+            # Keeping the columns (and dtypes) of an empty selection
+            frames = [get_clean_data(path, drop_columns, iqr_multiplier)[0].iloc[:0]]
+        # Partitions are listed by City then Month, so the concatenation stays sorted by City then Date
+        df = compact_dtypes(pd.concat(frames, ignore_index=True), dtypes)
+        return df, build_city_index(df)
+
+    return _cached(key, build)
+
+
+def get_data_options(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the cities, date range and per-measure (min, max) used to build the filter forms
+
+    For a partitioned dataset these come from the partition listing and the dataset bounds,
+    without reading any partition.
+    """
+    source = _source_key(path)
+    key = ("options",) + source + (tuple(drop_columns), iqr_multiplier)
+
+    def build():
+        if is_partitioned(path):
+            listing = get_partitions(path)
+            partitions = listing[0]
+            bounds = _get_dataset_schema(path, drop_columns, iqr_multiplier, listing)[0]
+            return {
+                'cities': list(partitions['City'].unique()),
+                'min_date': partitions['Month'].min().date(),
+                'max_date': (partitions['Month'].max() + pd.offsets.MonthEnd(0)).date(),
+                # Widest kept range over all cities, rounded like the float32 measures so the defaults keep every row
+                'ranges': {col: (round_bound(low), round_bound(high)) for col, low, high
+                           in bounds.groupby('Column', sort=False).agg({'Keep From': 'min', 'Keep To': 'max'}).itertuples(name=None)},
+            }
+
+        df_clean = get_clean_data(path, drop_columns, iqr_multiplier)[0]
+        return {
+            'cities': list(df_clean['City'].unique()),
+            'min_date': df_clean['Date'].min().date(),
+            'max_date': df_clean['Date'].max().date(),
+            'ranges': {col: (round_bound(df_clean[col].min()), round_bound(df_clean[col].max()))
+                       for col in df_clean.columns if col not in ('Date', 'City')},
+        }
+
+    return _cached(key, build)
+
+
+def get_city_index(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the shared City index (city -> row range) of the cleaned data, built once per file version"""
+    source = _source_key(path)
+    key = ("city_index",) + source + (tuple(drop_columns), iqr_multiplier)
+    return _cached(key, lambda: build_city_index(get_clean_data(path, drop_columns, iqr_multiplier)[0]))
+
+
+def get_rollups(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER, cities=None, date_range=None):
+    """Returning the shared daily/monthly rollups of the cleaned data, built once per file version
+
+    For a partitioned dataset the rollups cover the partitions of the City/Date selection.
+    """
+    if is_partitioned(path):
+        source, selected = _select_partitions(path, cities, date_range)
+        key = ("rollups",) + source + (tuple(drop_columns), iqr_multiplier, tuple(selected['path']))
+        return _cached(key, lambda: build_rollups(get_selection(cities, date_range, path, drop_columns, iqr_multiplier)[0]))
+
+    source = _source_key(path)
+    key = ("rollups",) + source + (tuple(drop_columns), iqr_multiplier)
+    return _cached(key, lambda: build_rollups(get_clean_data(path, drop_columns, iqr_multiplier)[0]))
+
+
+def get_derived(kind, key, build, path=DATA_FILE):
+    """Returning a shared value of the given kind derived from the current version of path, building it on a miss"""
+    source = _source_key(path)
+    return _cached((kind,) + source + (key,), build)
+
+
+def get_result(kind, key, build, path=DATA_FILE):
+    """Returning a shared query result of the given kind for key (a normalized query of the current version of path)
+
+    Results live in their own size-bounded LRU cache, so popular queries never evict the datasets.
+    """
+    source = _source_key(path)
+    return _cached((kind,) + source + (key,), build, _result_cache)
+
+
+def get_export(key, build, path=DATA_FILE):
+    """Returning the shared export artifact for key (a query of the data from path), building it on a miss"""
+    return get_result("export", key, build, path)
+
+
+def _ingest_lock(state_key):
+    """Returning the lock serializing the builds (and ingest state updates) of one source and cleaning parameters"""
+    with _data_cache_lock:
+        return _ingest_locks.setdefault(state_key, threading.Lock())
+
+
+def _update_clean_data(path, source, drop_columns, iqr_multiplier):
+    """Building the cleaned data of a new file version, ingesting only appended rows when possible
+
+    Builds of different versions of the same source (e.g. by the warm-up and a session)
+    run one at a time, so each appended row is ingested exactly once.
+    """
+    params = (tuple(drop_columns), iqr_multiplier)
+    state_key = (source[0],) + params
+
+    with _ingest_lock(state_key):
+        state = _ingest_states.get(state_key)
+        if state is not None and state['mtime'] > source[1]:
+            # A newer version was built meanwhile, holding every row appended up to this one
+            with _data_cache_lock:
+                newer = _data_cache.get(("clean", source[0], state['mtime']) + params)
+            if newer is not None:
+                return newer[0]
+
+        result = _ingest_appended_rows(path, source, params, state) if state else None
+
+        if result is None:
+            # Full rebuild, recording where the next incremental ingest starts
+            from ingest import read_header, tail_fingerprint
+
+            offset = os.stat(path).st_size
+            result = _build_clean_data(path, drop_columns, iqr_multiplier)
+            state = {
+                'header': read_header(path),
+                'offset': offset,
+                'fingerprint': tail_fingerprint(path, offset),
+                'base_rows': len(result[0]),
+                'appended_rows': 0,
+            }
+            _ingest_states[state_key] = state
+
+        state['mtime'] = source[1]
+    _drop_stale_versions(source[0], source[1])
+    return result
+
+
+def _ingest_appended_rows(path, source, params, state):
+    """Updating the previous version's cleaned data, City index and rollups with appended rows only
+
+    Returns the cleaned df and bounds report, or None when a full rebuild is needed: the
+    previous version is no longer cached, the file was rewritten, the appended rows are
+    not later than existing ones, or enough rows were appended to refresh the bounds.
+    """
+    from ingest import append_rows, clean_appended_rows, read_appended_rows, tail_fingerprint
+
+    def previous(kind):
+        with _data_cache_lock:
+            entry = _data_cache.get((kind, source[0], state['mtime']) + params)
+        return entry[0] if entry else None
+
+    previous_clean = previous("clean")
+    if previous_clean is None:
+        return None
+    df_previous, bounds = previous_clean
+
+    appended = read_appended_rows(path, state['offset'], state['header'], state['fingerprint'])
+    if appended is None:
+        return None
+    raw_new, offset = appended
+
+    new_rows = clean_appended_rows(raw_new, bounds, params[0])
+    if state['appended_rows'] + len(new_rows) > INGEST_REFRESH_FRACTION * state['base_rows']:
+        return None
+
+    index = previous("city_index") or build_city_index(df_previous)
+    df_clean = append_rows(df_previous, index, new_rows) if len(new_rows) else df_previous
+    if df_clean is None:
+        return None
+
+    # Publishing the derived structures of the new version next to it, aggregating the new rows at their stored precision
+    _store(("city_index",) + source + params, build_city_index(df_clean))
+    new_rows = new_rows.astype({col: dtype for col, dtype in df_clean.dtypes.items() if col != 'City'})
+    rollups = previous("rollups")
+    if rollups is not None:
+        _store(("rollups",) + source + params, merge_rollups(rollups, new_rows) if len(new_rows) else rollups)
+
+    state['offset'] = offset
+    state['fingerprint'] = tail_fingerprint(path, offset)
+    state['appended_rows'] += len(new_rows)
+    return df_clean, bounds
+
+
+def _build_clean_data(path, drop_columns, iqr_multiplier):
+    """Loading the cleaned data from its columnar cache file, falling back to cleaning in memory"""
+    try:
+        cache_path = materialize_clean_data(path, drop_columns, iqr_multiplier)
+        return _read_clean_cache(cache_path)
+    except (ImportError, OSError):
+        # pyarrow missing or cache directory not writable
+        return clean_data(get_raw_data(path), drop_columns, iqr_multiplier)
+
+
+def _file_hash(path):
+    """Hashing the contents of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clean_cache_path(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the columnar cache file for the cleaned data of path (keyed on the file hash and cleaning parameters)"""
+    params = json.dumps([CLEAN_CACHE_VERSION, list(drop_columns), iqr_multiplier, OUTLIER_MODE])
+    key = hashlib.sha256((_file_hash(path) + params).encode()).hexdigest()[:20]
+    source_dir, source_name = os.path.split(os.path.abspath(path))
+    return os.path.join(source_dir, DATA_CACHE_DIR, f"{os.path.splitext(source_name)[0]}.clean.{key}.arrow")
+
+
+def materialize_clean_data(path=DATA_FILE, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Writing the cleaned data of path to its columnar cache file unless already there, returning the file path"""
+    cache_path = clean_cache_path(path, drop_columns, iqr_multiplier)
+    if not os.path.exists(cache_path):
+        df_clean, bounds = clean_data(get_raw_data(path), drop_columns, iqr_multiplier)
+        _write_clean_cache(cache_path, df_clean, bounds)
+    return cache_path
+
+
+def _write_clean_cache(cache_path, df_clean, bounds):
+    """Writing the cleaned df (with the bounds report as metadata) to an uncompressed Arrow IPC file"""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df_clean, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    # Python's json writes floats at full precision (to_json rounds them), so stored bounds clean rows exactly like fresh ones
+    metadata[b'outlier_bounds'] = json.dumps(bounds.to_dict(orient='split', index=False)).encode('utf-8')
+    table = table.replace_schema_metadata(metadata)
+
+    # Writing to a temporary file first so readers never see a partial file
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, cache_path)
+    _prune_clean_cache(cache_path)
+
+
+def _prune_clean_cache(cache_path):
+    """Deleting the other cache files of the same source (older file versions or cleaning parameters)
+
+    Processes still mapping a deleted file keep reading it; where the OS refuses to delete
+    a mapped file it is left for a later prune.
+    """
+    cache_dir, cache_name = os.path.split(cache_path)
+    source_name = cache_name.split(".clean.")[0]
+    for file in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(source_name)}.clean.*.arrow")):
+        if file != cache_path:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+
+def _read_clean_cache(cache_path):
+    """Memory-mapping the columnar cache file, returning the cleaned df and the bounds report"""
+    import pyarrow as pa
+
+    # The mapping stays open as long as the frame's buffers reference it
+    table = pa.ipc.open_file(pa.memory_map(cache_path)).read_all()
+    df_clean = table.to_pandas(split_blocks=True)
+    bounds = pd.DataFrame(**json.loads(table.schema.metadata[b'outlier_bounds'].decode('utf-8')))
+    return df_clean, bounds
+
+
 def load_raw_data():
-    """Loading the raw data and stores it in st.session_state.df_raw"""
-    if 'df_raw' not in st.session_state:
-        df = pd.read_csv("Air_Quality.csv")
-        st.session_state.df_raw = df
+    """Loading the shared raw data"""
+    with stage("load_raw_data") as timing:
+        df = get_raw_data()
+        timing['rows'] = len(df)
+    return df
 
 def show_df_info(df):
     """Displaying df.info() output as text"""
@@ -41,49 +607,217 @@ def perform_missing_value_analysis(df):
     co2_missing_percent = missing_percent['CO2']
     st.write(f"CO2 column has {co2_missing_percent:.2f}% missing values. This column will be dropped.")
 
-def perform_outlier_analysis(df):
-    """Visualizing outliers with boxplots and applies outlier filtering"""
-    st.write("#### Outlier Analysis")
-    st.write("The outliers for each feature are visualized with boxplots below")
+def iqr_bounds(q1, q3, iqr_multiplier=IQR_MULTIPLIER):
+    """Returning the (lower, upper) outlier bounds for the given quartiles"""
+    iqr = q3 - q1
+    return q1 - iqr_multiplier * iqr, q3 + iqr_multiplier * iqr
+
+def _outlier_bounds(values, iqr_multiplier=IQR_MULTIPLIER, sequential=True):
+    """Computing the bounds report rows and the combined keep mask of a 2D float array (one column per measure)
+
+    Sequentially, each column's quartiles are computed on the rows kept by the previous
+    columns; jointly, all quartiles, minima and maxima come from one batched call over
+    every row. Either way a single row mask is combined column by column.
+    """
+    keep = np.ones(len(values), dtype=bool)
+    rows = []
+
+    if not sequential:
+        with warnings.catch_warnings():
+            # All-NaN columns yield NaN quartiles, handled below
+            warnings.simplefilter('ignore', RuntimeWarning)
+            quartiles = np.nanquantile(values, [0.25, 0.75], axis=0)
+            lows, highs = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        if sequential:
+            current = column[keep]
+            if not np.isfinite(current).any():
+                keep[:] = False
+                break
+            Q1, Q3 = np.nanquantile(current, [0.25, 0.75])
+            low, high = np.nanmin(current), np.nanmax(current)
+        else:
+            (Q1, Q3), low, high = quartiles[:, j], lows[j], highs[j]
+            if np.isnan(Q1):
+                keep[:] = False
+                break
+
+        # Calculating IQR bounds, clipped to the actual min/max of the data they were computed on
+        lower_bound, upper_bound = iqr_bounds(Q1, Q3, iqr_multiplier)
+        lower_bound_clipped = max(lower_bound, low)
+        upper_bound_clipped = min(upper_bound, high)
+
+        # Combining into the row mask
+        in_bounds = (column >= lower_bound) & (column <= upper_bound)
+        removed = int(np.count_nonzero(keep & ~in_bounds))
+        keep &= in_bounds
+
+        rows.append((j, Q1, Q3, lower_bound, upper_bound, lower_bound_clipped, upper_bound_clipped, removed))
+
+    return rows, keep
+
+def filter_outliers(df, iqr_multiplier=IQR_MULTIPLIER, mode=OUTLIER_MODE):
+    """Applying IQR outlier filtering to all numeric columns, returning the filtered df and a bounds report
+
+    mode is one of OUTLIER_MODES: "sequential" processes columns in order, each one's
+    quartiles computed on the rows kept by the previous columns; "joint" computes every
+    column's quartiles on all rows in one batched call; "per_city" applies the sequential
+    filtering to each City separately (in parallel threads), adding a City column to the report.
+    """
+    if mode not in OUTLIER_MODES:
+        raise ValueError(f"Unknown outlier mode {mode!r}, expected one of {', '.join(OUTLIER_MODES)}")
 
     numeric_columns = df.select_dtypes(include='number').columns
+    values = df[numeric_columns].to_numpy(dtype='float64')
+
+    if mode != "per_city":
+        rows, keep = _outlier_bounds(values, iqr_multiplier, sequential=(mode == "sequential"))
+        report = [(numeric_columns[row[0]],) + row[1:] for row in rows]
+    else:
+        codes, cities = pd.factorize(df['City'], sort=True)
+        # Grouping row positions by city in one stable sort (rows without a City are dropped)
+        order = np.argsort(codes, kind='stable')
+        city_rows = np.split(order, np.searchsorted(codes[order], np.arange(len(cities) + 1)))[1:-1]
+        with ThreadPoolExecutor(max_workers=OUTLIER_WORKERS) as pool:
+            results = list(pool.map(lambda rows: _outlier_bounds(values[rows], iqr_multiplier), city_rows))
+
+        keep = np.zeros(len(df), dtype=bool)
+        report = []
+        for city, rows, (city_report, city_keep) in zip(cities, city_rows, results):
+            keep[rows[city_keep]] = True
+            report.extend((city, numeric_columns[row[0]]) + row[1:] for row in city_report)
+
+    columns = ['Column', 'Q1', 'Q3', 'Lower Bound', 'Upper Bound', 'Keep From', 'Keep To', 'Rows Removed']
+    bounds = pd.DataFrame(report, columns=(['City'] if mode == "per_city" else []) + columns)
+    return df[keep], bounds
+
+def apply_outlier_bounds(df, bounds):
+    """Keeping the rows of df within previously computed outlier bounds (a filter_outliers report)
+
+    With a per-city report each City is checked against its own bounds; rows of cities
+    the report does not cover are kept as they are.
+    """
+    keep = np.ones(len(df), dtype=bool)
+    if 'City' in bounds.columns:
+        cities = df['City'].to_numpy()
+        for (city, col), lower_bound, upper_bound in bounds.set_index(['City', 'Column'])[['Lower Bound', 'Upper Bound']].itertuples(name=None):
+            values = df[col].to_numpy(dtype='float64')
+            keep &= (cities != city) | ((values >= lower_bound) & (values <= upper_bound))
+        return df[keep]
 
+    for col, lower_bound, upper_bound in bounds[['Column', 'Lower Bound', 'Upper Bound']].itertuples(index=False, name=None):
+        values = df[col].to_numpy(dtype='float64')
+        keep &= (values >= lower_bound) & (values <= upper_bound)
+    return df[keep]
+
+def perform_outlier_analysis(df, bounds, show_boxplots=False):
+    """Displaying the bounds kept by the outlier filtering, with optional boxplots of the data each bound was computed on"""
+    st.write("#### Outlier Analysis")
+
+    if 'City' in bounds.columns:
+        st.write("Outlier bounds are computed separately for each city:")
+        st.dataframe(bounds[['City', 'Column', 'Keep From', 'Keep To', 'Rows Removed']], hide_index=True)
+    else:
+        for col, keep_from, keep_to in bounds[['Column', 'Keep From', 'Keep To']].itertuples(index=False, name=None):
+            st.write(f"**{col}:** Keeping values between {keep_from:.2f} and {keep_to:.2f}")
+
+    if not show_boxplots:
+        return
+
+    from charts import box_figure
+
+    # Sequentially each column's bounds come from the rows kept by the previous columns
+    sequential = OUTLIER_MODE == "sequential" and 'City' not in bounds.columns
+
+    st.write("The outliers for each feature are visualized with boxplots below")
+    if sequential:
+        st.caption("Each boxplot shows the rows left after filtering the columns above it, the data its bounds were computed on.")
+    else:
+        st.caption(f"Boxplots show the unfiltered data (outlier mode `{OUTLIER_MODE}`).")
     with st.expander("Click to view boxplots for all numeric columns"):
-        for col in numeric_columns:
+        for col, lower_bound, upper_bound in bounds[['Column', 'Lower Bound', 'Upper Bound']].drop_duplicates('Column').itertuples(index=False, name=None):
             st.write(f"#### Boxplot for `{col}`")
-            fig = px.box(df, y=col)
+            fig = box_figure(df, col)
             st.plotly_chart(fig, use_container_width=True)
 
-            # Calculating IQR bounds
-            Q1 = df[col].quantile(0.25)
-            Q3 = df[col].quantile(0.75)
-            IQR = Q3 - Q1
-            lower_bound = Q1 - 1.5 * IQR
-            upper_bound = Q3 + 1.5 * IQR
+            # Applying this column's filtering before the next boxplot
+            if sequential:
+                df = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
 
-            # Calculating actual min/max in current data
-            actual_min = df[col].min()
-            actual_max = df[col].max()
 
-            # Clipping the bounds for user message
-            lower_bound_clipped = max(lower_bound, actual_min)
-            upper_bound_clipped = min(upper_bound, actual_max)
+def prepare_data(df_raw, drop_columns=DROP_COLUMNS):
+    """Dropping unused columns and converting Date (a new frame, so the shared raw df is never modified)"""
+    # Dropping CO2 column
+    df = df_raw.drop(columns=list(drop_columns))
 
-            # Displaying message with clipped values
-            st.write(f"**{col}:** Keeping values between {lower_bound_clipped:.2f} and {upper_bound_clipped:.2f}")
+    # Converting to Date
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce').dt.tz_localize(None)
+    return df
 
-            # Applying actual filtering
-            df = df[(df[col] >= lower_bound) & (df[col] <= upper_bound)]
 
-    return df
+def clean_data(df_raw, drop_columns=DROP_COLUMNS, iqr_multiplier=IQR_MULTIPLIER):
+    """Cleaning the raw data without any rendering, returning the compact cleaned df and the outlier bounds report"""
+    df = prepare_data(df_raw, drop_columns)
 
+    # Performing outlier filtering
+    df, bounds = filter_outliers(df, iqr_multiplier)
 
-def load_clean_data():
-    """Loading, cleaning data, and storing result in st.session_state.df_clean"""
-    # Ensuring raw data is loaded
-    load_raw_data()
-    df = st.session_state.df_raw.copy()
+    # Dropping remaining NaNs, sorting by City then Date (required by the City index) and reset index
+    df_clean = df.dropna().sort_values(['City', 'Date'], kind='stable').reset_index(drop=True)
+
+    return compact_dtypes(df_clean), bounds
+
+
+def schema_dtypes(df):
+    """Deciding the compact dtypes of a cleaned df, the schema every subset of it is cast to
+
+    Date becomes datetime64, City categorical (over all its cities), and every measure
+    float32, or the smallest integer type when all its values are whole numbers that fit it.
+    """
+    dtypes = {}
+    for col in df.columns:
+        if col == 'Date':
+            dtypes[col] = 'datetime64[ns]'
+        elif col == 'City':
+            dtypes[col] = pd.CategoricalDtype(sorted(df[col].astype(str).unique()))
+        else:
+            values = df[col].to_numpy(dtype='float64')
+            whole = bool(len(values)) and np.array_equal(values, np.round(values))
+            dtypes[col] = measure_dtype(whole, values.min() if whole else None, values.max() if whole else None)
+    return dtypes
+
+
+def measure_dtype(whole, low=None, high=None):
+    """Choosing the dtype of a measure: the smallest integer type holding low..high if all its values are whole, else float32"""
+    if not whole:
+        return 'float32'
+    for dtype in ('int8', 'int16', 'int32'):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return 'int64'
+
+
+def fits_dtypes(df, dtypes):
+    """Checking that the measures of df can be cast to the integer dtypes of a schema without changing any value"""
+    for col, dtype in dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype):
+            values = df[col].to_numpy(dtype='float64')
+            info = np.iinfo(dtype)
+            if not (np.array_equal(values, np.round(values)) and (values >= info.min).all() and (values <= info.max).all()):
+                return False
+    return True
 
+
+def compact_dtypes(df, dtypes=None):
+    """Converting a cleaned df to compact dtypes, those of its dataset version's schema when given (else decided from df itself)"""
+    dtypes = schema_dtypes(df) if dtypes is None else dtypes
+    return pd.DataFrame({col: df[col].astype(dtypes[col]) for col in df.columns})
+
+
+def show_cleaning_steps():
+    """Displaying the steps taken for data cleaning"""
     st.write("#### Steps taken for data cleaning")
     st.write("""
     - The **'Date'** column is stored as a string. This should be converted to Date.
@@ -91,17 +825,30 @@ def load_clean_data():
     - We can see the outliers detected in few features of dataset.
     """)
 
-    # Converting to Date
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce').dt.tz_localize(None)
 
-    # Dropping CO2 column
-    df = df.drop(columns=['CO2'])
+def load_clean_data():
+    """Loading the shared cleaned data"""
+    with stage("load_clean_data") as timing:
+        df_clean, _ = get_clean_data()
+        timing['rows'] = len(df_clean)
+    return df_clean
+
+
+def load_city_index():
+    """Loading the shared City index of the cleaned data"""
+    with stage("load_city_index"):
+        return get_city_index()
+
 
-    # Performing outlier analysis and filtering
-    df = perform_outlier_analysis(df)
+def load_rollups(cities=None, date_range=None):
+    """Loading the shared daily/monthly rollups of the cleaned data (of the selection for a partitioned dataset)"""
+    with stage("load_rollups"):
+        return get_rollups(cities=cities, date_range=date_range)
 
-    # Dropping remaining NaNs and reset index
-    df_clean = df.dropna().reset_index(drop=True)
 
-    # Storing in session_state
-    st.session_state.df_clean = df_clean
+def load_selection(cities=None, date_range=None):
+    """Loading the cleaned df and City index holding the rows of a City/Date selection"""
+    with stage("load_selection") as timing:
+        df, index = get_selection(cities, date_range)
+        timing['rows'] = len(df)
+    return df, index
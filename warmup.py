@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+
+from analytics import EXCEEDANCE_LIMITS
+from backends import backend_name, category_data, correlate_data, exceedance_data, load_data_options, summarize_data
+from dataset import is_partitioned
+from rollups import METRICS
+from utils import DATA_FILE, get_raw_data, source_version
+
+# Background warm-up of the shared data at app start (AIR_QUALITY_WARMUP=0 prepares everything on demand instead)
+WARMUP_ENV_VAR = "AIR_QUALITY_WARMUP"
+# Threads running the warm-up steps that follow the data load (None lets the pool choose)
+WARMUP_WORKERS = None
+# Seconds between progress refreshes of a page waiting for the warm-up
+WARMUP_POLL_SECONDS = 0.5
+
+logger = logging.getLogger("air_quality.warmup")
+
+# Warm-up of the current dataset version, shared by every session ('ready' once the options of any version were published)
+_warmup = {'source': None, 'steps': [], 'done': 0, 'running': [], 'error': None, 'finished': True, 'ready': False}
+_warmup_lock = threading.Lock()
+
+
+def warmup_steps(path=DATA_FILE):
+    """Listing the warm-up steps as (label, function); the first one loads the data (and filter options) the others build on"""
+    steps = [("Loading and cleaning the data", load_data_options)]
+
+    # The DuckDB backend scans the files instead of holding them in memory
+    if backend_name() == "pandas":
+        steps.append(("Reading the raw data preview", get_raw_data))
+
+    # Aggregates over all cities would read every partition of a partitioned dataset
+    if not is_partitioned(path):
+        steps.append(("Summarizing the metrics per city", lambda: [summarize_data(metric) for metric in METRICS]))
+        steps.append(("Correlating the metrics", correlate_data))
+        steps.append(("Counting the hours above the guideline limits",
+                      lambda: [exceedance_data(metric, limit, hours) for metric, (limit, hours) in EXCEEDANCE_LIMITS.items()]))
+        steps.append(("Counting the hours per AQI category", category_data))
+    return steps
+
+
+def warmup_enabled():
+    """Checking whether the background warm-up is enabled"""
+    return os.environ.get(WARMUP_ENV_VAR, "1") != "0"
+
+
+def _set_running(source, labels):
+    """Recording the running warm-up steps, unless a warm-up of a newer dataset version took over"""
+    with _warmup_lock:
+        if _warmup['source'] == source:
+            _warmup['running'] = list(labels)
+
+
+def _finish_step(source, label, error=None):
+    """Recording a finished warm-up step (and its error, if any), unless a newer warm-up took over"""
+    with _warmup_lock:
+        if _warmup['source'] != source:
+            return
+        _warmup['done'] += 1
+        _warmup['running'].remove(label)
+        if error is not None and _warmup['error'] is None:
+            _warmup['error'] = f"{label}: {error}"
+
+
+def _run_warmup(source, steps):
+    """Running the warm-up steps: the data load first, then the rest in a thread pool
+
+    Every step publishes its results to the shared caches as a whole, so sessions either
+    find a finished value there or build it themselves, never a partial one.
+    """
+    started = time.perf_counter()
+    (label, load), rest = steps[0], steps[1:]
+    try:
+        _set_running(source, [label])
+        try:
+            load()
+        except Exception as error:
+            logger.exception("Warm-up step failed: %s", label)
+            _finish_step(source, label, error)
+            return
+        finally:
+            # Pages only need the data and filter options, the remaining steps run behind them
+            with _warmup_lock:
+                if _warmup['source'] == source:
+                    _warmup['ready'] = True
+        _finish_step(source, label)
+
+        _set_running(source, [label for label, _ in rest])
+        with ThreadPoolExecutor(WARMUP_WORKERS, thread_name_prefix="air-quality-warmup") as pool:
+            futures = {pool.submit(step): label for label, step in rest}
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    logger.error("Warm-up step failed: %s: %s", futures[future], error)
+                _finish_step(source, futures[future], error)
+    finally:
+        with _warmup_lock:
+            if _warmup['source'] == source:
+                _warmup['running'] = []
+                _warmup['finished'] = True
+        logger.info("Warm-up finished in %.3f s", time.perf_counter() - started)
+
+
+def start_warmup(path=DATA_FILE):
+    """Starting the background warm-up of the current dataset version, unless it already ran or is running
+
+    Pages keep being served while a newer version warms up; only the first warm-up of the
+    process keeps them waiting.
+    """
+    if not warmup_enabled():
+        return
+    source = source_version(path)
+    with _warmup_lock:
+        if _warmup['source'] == source:
+            return
+        steps = warmup_steps(path)
+        _warmup.update({'source': source, 'steps': [label for label, _ in steps], 'done': 0, 'running': [],
+                        'error': None, 'finished': False, 'ready': _warmup['ready']})
+    threading.Thread(target=_run_warmup, args=(source, steps), name="air-quality-warmup", daemon=True).start()
+
+
+def warmup_status():
+    """Returning a snapshot of the warm-up progress: step labels, steps done, running steps, error, whether it finished and whether pages can load"""
+    with _warmup_lock:
+        return {**_warmup, 'steps': list(_warmup['steps']), 'running': list(_warmup['running'])}
+
+
+@st.fragment(run_every=WARMUP_POLL_SECONDS)
+def show_warmup_progress():
+    """Showing the warm-up progress, rerunning the page once it can load"""
+    status = warmup_status()
+    if status['ready']:
+        st.rerun()
+    total = max(len(status['steps']), 1)
+    st.progress(status['done'] / total, text=f"Preparing the data ({status['done']} of {total} steps): {', '.join(status['running']) or 'starting'}")
+
+
+def wait_for_warmup():
+    """Starting the warm-up if needed and showing its progress until the data is loaded; returns whether the page can load its data
+
+    Pages waiting here poll the shared warm-up instead of repeating its work. A failed
+    warm-up does not stop them: the data is then prepared on demand, as without warm-up.
+    """
+    start_warmup()
+    status = warmup_status()
+    if warmup_enabled() and not status['ready']:
+        st.info("The shared data is being prepared in the background. This page loads as soon as it is ready.")
+        show_warmup_progress()
+        return False
+    if status['error'] is not None:
+        st.caption(f"Background warm-up failed ({status['error']}), preparing the data on demand.")
+    return True